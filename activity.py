@@ -3,7 +3,9 @@ import sqlite3
 import sys
 import traceback
 
-from util.database import Database, Event
+from util.cache import ResponseCache
+from util.database import Database
+from util.repos import RepoFilter
 
 
 def main():
@@ -13,12 +15,25 @@ def main():
         parser.add_argument('--days', '-d',
                             required=True,
                             help='Days since last update.')
+        parser.add_argument('--feed',
+                            action='store_true',
+                            help='Read the organization event feed instead '
+                            'of every repository\'s events.')
+        parser.add_argument('--no-cache',
+                            action='store_true',
+                            help='Do not read or write the local response '
+                            'cache.')
         parser.add_argument('--organization', '-o',
                             required=True,
                             help='Organization to scan. (Required)')
         parser.add_argument('--password', '-p',
                             required=True,
                             help='Your GitHub password. (Required)')
+        parser.add_argument('--skip-quiet',
+                            action='store_true',
+                            help='Skip repositories that had nothing to '
+                            'report last run and have not changed since. '
+                            'May miss changes for up to a day.')
         parser.add_argument('--timezone', '-t',
                             help='Timezone from the Olson database. '
                             '(https://en.wikipedia.org/wiki/List_of_'
@@ -32,38 +47,41 @@ def main():
         conn = sqlite3.connect('events.db', detect_types=sqlite3.PARSE_DECLTYPES|sqlite3.PARSE_COLNAMES)
         cur = conn.cursor()
 
-        db = Database(conn, cur)
+        db = Database(conn, cur, timezone=args.timezone)
         db.build()
-        db.populate(args.organization, args.username, args.password, args.timezone)
 
-        cur.execute("SELECT * "
-                    "FROM data "
-                    "WHERE created_at >= date('now', ? || ' days')", ((-int(args.days)), ))
-        rows = cur.fetchall()
+        cache = None
+        if not args.no_cache:
+            cache = ResponseCache()
 
-        created_date_new = None
-        for row in rows:
-            event = Event(row)
-            if created_date_new != event.created_date:
-                print('\n## {}\n'.format(event.created_date))
+        # Events come from pushes too, so repos without issues still count
+        repo_filter = RepoFilter(args.organization, 'activity',
+                                 skip_quiet=args.skip_quiet,
+                                 require_issues=False)
 
-            source_id = ''
-            if event.payload_id:
-                source_id = '[{}]({})'.format(event.payload_id[:7], event.url)
-            action = ''
-            if event.action:
-                action = '{}'.format(event.action)
-            print('- **{}** {}\n'
-                  '  - :wrench: {} {} {} (:memo:{})\n'
-                  '  - :page_facing_up: {}'.format(event.created_time,
-                                                   event.fullname,
-                                                   action,
-                                                   event.event,
-                                                   source_id,
-                                                   event.repo,
-                                                   event.title))
+        db.populate(args.organization, args.username, args.password,
+                    args.timezone, feed=args.feed, cache=cache,
+                    repo_filter=repo_filter)
 
-            created_date_new = event.created_date
+        for created_date, events in db.get_days(args.days):
+            print('\n## {}\n'.format(created_date))
+
+            for event in events:
+                source_id = ''
+                if event.payload_id:
+                    source_id = '[{}]({})'.format(event.payload_id[:7], event.url)
+                action = ''
+                if event.action:
+                    action = '{}'.format(event.action)
+                print('- **{}** {}\n'
+                      '  - :wrench: {} {} {} (:memo:{})\n'
+                      '  - :page_facing_up: {}'.format(event.created_time,
+                                                       event.fullname,
+                                                       action,
+                                                       event.event,
+                                                       source_id,
+                                                       event.repo,
+                                                       event.title))
 
         cur.close()
 
@@ -0,0 +1,275 @@
+import sys
+import os
+import json
+import time
+import argparse
+import tempfile
+import traceback
+import contextlib
+import subprocess
+import tracemalloc
+import multiprocessing
+
+from datetime import datetime
+from urllib.request import urlopen
+
+import activity
+import closed
+import tracker
+import util.client
+import util.database
+
+from bench.server import Org, serve
+from util.github import GitHub, Scheduler
+
+MILESTONE = 'Bench Milestone'
+
+SCENARIOS = [
+    # (name, module, arguments, prepare)
+    ('tracker', tracker,
+     ['-m', MILESTONE, '-i', 'bench/tracking/issues/1', '--no-cache',
+      '--full'], None),
+    ('tracker-bulk', tracker,
+     ['-m', MILESTONE, '-i', 'bench/tracking/issues/1', '--no-cache',
+      '--bulk'], None),
+    ('tracker-orgs', tracker,
+     ['-m', MILESTONE, '-i', 'bench/tracking/issues/1', '--no-cache',
+      '--full', '-o', 'bench2'], None),
+    ('tracker-warm', tracker,
+     ['-m', MILESTONE, '-i', 'bench/tracking/issues/1'], 'touch'),
+    ('closed', closed,
+     ['-d', '7', '-f', 'closed.md', '--no-cache'], None),
+    ('closed-bulk', closed,
+     ['-d', '7', '-f', 'closed.md', '--no-cache', '--bulk'], None),
+    ('closed-warm', closed,
+     ['-d', '7', '-f', 'closed.md'], 'touch'),
+    ('activity', activity,
+     ['-d', '30', '--no-cache'], None),
+    ('activity-warm', activity,
+     ['-d', '30'], 'touch'),
+    ('activity-feed', activity,
+     ['-d', '30', '--feed'], None)
+]
+
+
+def run_server(options, queue):
+    org = Org(repos=options['repos'],
+              milestone=MILESTONE,
+              every=options['every'],
+              issues=options['issues'],
+              events=options['events'])
+    server = serve(org, latency=options['latency'])
+    queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+def stats(base_url, action):
+    with urlopen('{}/_bench/{}'.format(base_url, action)) as response:
+        return json.loads(response.read().decode('utf-8'))
+
+
+def patch(base_url, rate):
+    def client(*args, **kwargs):
+        kwargs.setdefault('base_url', base_url)
+        kwargs.setdefault('scheduler', Scheduler(rate=rate, burst=rate))
+        return GitHub(*args, **kwargs)
+
+    util.client.GitHub = client
+    util.database.GitHub = client
+
+
+def execute(module, arguments):
+    sys.argv = ['{}.py'.format(module.__name__), '-u', 'bench',
+                '-p', 'bench', '-o', 'bench'] + arguments
+    with open(os.devnull, 'w') as devnull:
+        with contextlib.redirect_stdout(devnull):
+            return module.main()
+
+
+def measure(base_url, name, module, arguments, prepare, memory):
+    with tempfile.TemporaryDirectory() as directory:
+        cwd = os.getcwd()
+        os.chdir(directory)
+        try:
+            # Warm scenarios get one untimed run first so the cache and
+            # snapshot are populated, then a few issues change upstream
+            if prepare is not None:
+                execute(module, arguments)
+                stats(base_url, prepare)
+
+            stats(base_url, 'reset')
+            if memory:
+                tracemalloc.start()
+            start = time.perf_counter()
+            cpu = time.process_time()
+            code = execute(module, arguments)
+            wall = time.perf_counter() - start
+            cpu = time.process_time() - cpu
+            peak = None
+            if memory:
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+        finally:
+            os.chdir(cwd)
+
+    result = stats(base_url, 'stats')
+    return {
+        'scenario': name,
+        'ok': code is None,
+        'wall': round(wall, 4),
+        'cpu': round(cpu, 4),
+        'requests': result['requests'],
+        'not_modified': result['not_modified'],
+        'bytes': result['bytes'],
+        'peak_memory': peak
+    }
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except Exception:
+        return None
+
+
+def load_results(path):
+    results = []
+    if os.path.exists(path):
+        with open(path) as history:
+            for line in history:
+                if line.strip():
+                    results.append(json.loads(line))
+    return results
+
+
+def get_change(previous, result, key):
+    if not previous.get(key) or result[key] is None:
+        return 'n/a'
+    change = (result[key] - previous[key]) / previous[key] * 100
+    return '{:+.0f}%'.format(change)
+
+
+def main():
+    try:
+        parser = argparse.ArgumentParser(description='Replay benchmarks for '
+                                         'tracker, closed and activity')
+        parser.add_argument('--events',
+                            type=int,
+                            default=30,
+                            help='Events per repository. (Default: 30)')
+        parser.add_argument('--every',
+                            type=int,
+                            default=10,
+                            help='Every Nth repository carries the '
+                            'milestone. (Default: 10)')
+        parser.add_argument('--issues',
+                            type=int,
+                            default=60,
+                            help='Issues per milestone. (Default: 60)')
+        parser.add_argument('--latency',
+                            type=float,
+                            default=20,
+                            help='Simulated latency per request in '
+                            'milliseconds. (Default: 20)')
+        parser.add_argument('--no-memory',
+                            action='store_true',
+                            help='Skip peak memory tracing, which slows '
+                            'the timed run.')
+        parser.add_argument('--output',
+                            default=os.path.join('bench', 'results.jsonl'),
+                            help='File results are appended to. '
+                            '(Default: bench/results.jsonl)')
+        parser.add_argument('--rate',
+                            type=float,
+                            default=1000,
+                            help='Scheduler requests per second. '
+                            '(Default: 1000)')
+        parser.add_argument('--repos',
+                            type=int,
+                            default=200,
+                            help='Repositories in the organization. '
+                            '(Default: 200)')
+        parser.add_argument('--scenario', '-s',
+                            action='append',
+                            help='Only run the named scenario. May be '
+                            'repeated.')
+
+        args = parser.parse_args()
+
+        options = {
+            'repos': args.repos,
+            'every': args.every,
+            'issues': args.issues,
+            'events': args.events,
+            'latency': args.latency / 1000.0
+        }
+
+        queue = multiprocessing.Queue()
+        server = multiprocessing.Process(target=run_server,
+                                         args=(options, queue),
+                                         daemon=True)
+        server.start()
+        base_url = 'http://127.0.0.1:{}'.format(queue.get(timeout=60))
+        patch(base_url, args.rate)
+
+        history = load_results(args.output)
+        commit = get_commit()
+        date = datetime.now().isoformat(timespec='seconds')
+        params = dict(options, rate=args.rate, memory=not args.no_memory)
+
+        print('{:<14} {:>9} {:>9} {:>9} {:>12} {:>12}'.format(
+            'Scenario', 'Wall (s)', 'CPU (s)', 'Requests', 'Bytes',
+            'Peak (KB)'))
+
+        results = []
+        for name, module, arguments, prepare in SCENARIOS:
+            if args.scenario and name not in args.scenario:
+                continue
+
+            result = measure(base_url, name, module, arguments, prepare,
+                             not args.no_memory)
+            result.update({'commit': commit, 'date': date, 'params': params})
+            results.append(result)
+
+            previous = None
+            for entry in history:
+                if entry['scenario'] == name and entry['params'] == params:
+                    previous = entry
+
+            peak = ''
+            if result['peak_memory'] is not None:
+                peak = '{:.0f}'.format(result['peak_memory'] / 1024.0)
+            print('{:<14} {:>9.3f} {:>9.3f} {:>9} {:>12} {:>12}'.format(
+                name + ('' if result['ok'] else ' !'),
+                result['wall'],
+                result['cpu'],
+                result['requests'],
+                result['bytes'],
+                peak))
+
+            # Compare against the last run with the same parameters
+            if previous is not None:
+                print('  vs {}: wall {}, requests {}, bytes {}, '
+                      'peak {}'.format(
+                          previous['commit'],
+                          get_change(previous, result, 'wall'),
+                          get_change(previous, result, 'requests'),
+                          get_change(previous, result, 'bytes'),
+                          get_change(previous, result, 'peak_memory')))
+
+        server.terminate()
+
+        with open(args.output, 'a') as out:
+            for result in results:
+                out.write(json.dumps(result) + '\n')
+
+    except:
+        print('\n')
+        traceback.print_exc(file=sys.stdout)
+        print('\n')
+        return 2
+
+if __name__ == "__main__":
+    sys.exit(main())
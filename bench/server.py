@@ -0,0 +1,467 @@
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlsplit
+from util.github import GITHUB_DATE_FORMAT
+
+LABELS = ['bug', 'enhancement', 'High Priority', 'question', 'ui', 'api',
+          'documentation', 'wontfix']
+USERS = ['alice', 'bob', 'carol', 'dave', 'erin', 'frank']
+
+
+class Org:
+    def __init__(self, name='bench', repos=200, milestone='Bench Milestone',
+                 every=10, issues=60, events=30, seed=1):
+        self.name = name
+        self.milestone = milestone
+        self.now = datetime.utcnow().replace(hour=0, minute=0, second=0,
+                                             microsecond=0)
+        self.random = random.Random(seed)
+        self.repos = []
+        self.repo_names = {}
+        self.milestones = {}
+        self.issues = {}
+        self.events = {}
+
+        for i in range(repos):
+            repo_name = 'repo-{:04d}'.format(i)
+
+            # Like a real organization, some repositories are archived or
+            # have issues turned off.  Never the ones carrying the milestone.
+            archived = i % every != 0 and i % 20 == 7
+            has_issues = i % every == 0 or i % 20 != 13
+
+            repo = {
+                'id': i + 1,
+                'name': repo_name,
+                'full_name': '{}/{}'.format(name, repo_name),
+                'private': False,
+                'archived': archived,
+                'has_issues': has_issues,
+                'open_issues_count': 0,
+                'description': 'Synthetic repository {}'.format(i),
+                'pushed_at': self.date(self.random.randint(0, 90)),
+                'updated_at': self.date(self.random.randint(0, 90))
+            }
+            self.repos.append(repo)
+            self.repo_names[repo_name] = repo
+
+            milestones = [self.make_milestone(repo_name, 1, 'Backlog')]
+            count = max(1, issues // 10)
+            if i % every == 0:
+                milestones.append(self.make_milestone(repo_name, 2,
+                                                      milestone))
+                count = issues
+            self.milestones[repo_name] = milestones
+
+            if not has_issues:
+                count = 0
+            self.issues[repo_name] = [
+                self.make_issue(repo_name, number, milestones[-1])
+                for number in range(1, count + 1)]
+            self.count_milestones(repo_name)
+
+            self.events[repo_name] = [
+                self.make_event(repo_name, i * events + number)
+                for number in range(events)]
+
+        # The organization feed is newest first and, like GitHub's, only
+        # goes back 300 events
+        self.feed = []
+        for repo_events in self.events.values():
+            self.feed += repo_events
+        self.feed.sort(key=lambda k: (k['created_at'], k['id']), reverse=True)
+        self.feed = self.feed[:300]
+
+    def date(self, days_ago, hours_ago=0):
+        value = self.now - timedelta(days=days_ago, hours=hours_ago)
+        return value.strftime(GITHUB_DATE_FORMAT)
+
+    def user(self, login):
+        return {
+            'login': login,
+            'id': USERS.index(login) + 1,
+            'avatar_url': 'https://avatars.example.com/u/{}'.format(login),
+            'url': 'https://api.github.com/users/{}'.format(login),
+            'html_url': 'https://github.com/{}'.format(login),
+            'type': 'User',
+            'site_admin': False
+        }
+
+    def make_milestone(self, repo_name, number, title):
+        return {
+            'number': number,
+            'title': title,
+            'state': 'open',
+            'description': 'Synthetic milestone',
+            'html_url': 'https://github.com/{}/{}/milestone/{}'.format(
+                self.name, repo_name, number),
+            'open_issues': 0,
+            'closed_issues': 0,
+            'due_on': self.date(-30),
+            'created_at': self.date(120),
+            'updated_at': self.date(1)
+        }
+
+    def make_issue(self, repo_name, number, milestone):
+        created = self.random.randint(1, 60)
+        state = self.random.choice(['open', 'closed', 'closed'])
+        labels = self.random.sample(LABELS, self.random.randint(0, 3))
+        assignee = self.random.choice(USERS + [None])
+        issue = {
+            'number': number,
+            'title': 'Synthetic issue {} in {}'.format(number, repo_name),
+            'state': state,
+            'html_url': 'https://github.com/{}/{}/issues/{}'.format(
+                self.name, repo_name, number),
+            'repository_url': 'https://api.github.com/repos/{}/{}'.format(
+                self.name, repo_name),
+            'user': self.user(self.random.choice(USERS)),
+            'assignee': None,
+            'assignees': [],
+            'labels': [{
+                'name': label,
+                'color': 'ededed',
+                'default': False,
+                'url': 'https://api.github.com/labels/{}'.format(label)
+            } for label in labels],
+            'milestone': milestone,
+            'comments': self.random.randint(0, 20),
+            'created_at': self.date(created),
+            'updated_at': self.date(self.random.randint(0, created)),
+            'closed_at': None,
+            'body': 'Lorem ipsum dolor sit amet. ' * 20
+        }
+        if assignee is not None:
+            issue['assignee'] = self.user(assignee)
+            issue['assignees'] = [self.user(assignee)]
+        if state == 'closed':
+            issue['closed_at'] = self.date(self.random.randint(0, created))
+            # Closing an issue updates it too
+            issue['updated_at'] = max(issue['updated_at'], issue['closed_at'])
+        if number % 4 == 0:
+            issue['pull_request'] = {
+                'url': 'https://api.github.com/repos/{}/{}/pulls/{}'.format(
+                    self.name, repo_name, number)
+            }
+        return issue
+
+    def make_event(self, repo_name, number):
+        kind = self.random.choice(['IssuesEvent', 'PushEvent',
+                                   'CreateEvent', 'IssueCommentEvent'])
+        event = {
+            'id': str(1000000 + number),
+            'type': kind,
+            'actor': self.user(self.random.choice(USERS)),
+            'repo': {'name': '{}/{}'.format(self.name, repo_name)},
+            'created_at': self.date(self.random.randint(0, 20),
+                                    self.random.randint(0, 23)),
+            'payload': {}
+        }
+        issue = {
+            'number': number + 1,
+            'title': 'Synthetic issue {}'.format(number + 1),
+            'html_url': 'https://github.com/{}/{}/issues/{}'.format(
+                self.name, repo_name, number + 1)
+        }
+        if kind == 'IssuesEvent':
+            event['payload'] = {'action': 'closed', 'issue': issue}
+        elif kind == 'IssueCommentEvent':
+            event['payload'] = {
+                'action': 'created',
+                'issue': issue,
+                'comment': {'html_url': issue['html_url'] + '#comment'}
+            }
+        elif kind == 'PushEvent':
+            sha = hashlib.sha1(event['id'].encode()).hexdigest()
+            event['payload'] = {
+                'ref': 'refs/heads/master',
+                'commits': [{
+                    'sha': sha,
+                    'message': 'Synthetic commit\n\nDetails',
+                    'url': 'https://api.github.com/repos/{}/{}/commits/{}'
+                           .format(self.name, repo_name, sha)
+                }]
+            }
+        else:
+            event['payload'] = {'ref': 'feature-{}'.format(number),
+                                'ref_type': 'branch'}
+        return event
+
+    def count_milestones(self, repo_name):
+        repo = self.repo_names[repo_name]
+        repo['open_issues_count'] = 0
+        for milestone in self.milestones[repo_name]:
+            milestone['open_issues'] = 0
+            milestone['closed_issues'] = 0
+        for issue in self.issues[repo_name]:
+            if issue['state'] == 'open':
+                repo['open_issues_count'] += 1
+                issue['milestone']['open_issues'] += 1
+            else:
+                issue['milestone']['closed_issues'] += 1
+
+    def touch(self, count=5):
+        # Close a few open issues so incremental runs have work to do
+        now = datetime.utcnow().strftime(GITHUB_DATE_FORMAT)
+        touched = 0
+        for repo_name in sorted(self.issues):
+            for issue in self.issues[repo_name]:
+                if touched < count and issue['state'] == 'open' and \
+                        issue['milestone']['title'] == self.milestone:
+                    issue['state'] = 'closed'
+                    issue['closed_at'] = now
+                    issue['updated_at'] = now
+                    self.count_milestones(repo_name)
+                    touched += 1
+        return touched
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        return
+
+    def do_GET(self):
+        self.handle_request('get')
+
+    def do_PATCH(self):
+        self.handle_request('patch')
+
+    def do_POST(self):
+        self.handle_request('post')
+
+    def handle_request(self, method):
+        server = self.server
+        url = urlsplit(self.path)
+        params = dict(parse_qsl(url.query))
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+
+        if url.path.startswith('/_bench/'):
+            return self.bench(url.path, params)
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        status, result, paged = route(server, method, url.path, params, body)
+        if paged is not None:
+            result, links = self.paginate(url.path, params, result, paged)
+        else:
+            links = []
+        self.send(status, result, links)
+
+    def bench(self, path, params):
+        server = self.server
+        if path == '/_bench/reset':
+            with server.lock:
+                server.requests = 0
+                server.bytes_sent = 0
+                server.not_modified = 0
+                server.remaining = 5000
+        elif path == '/_bench/touch':
+            server.org.touch(int(params.get('count', 5)))
+        with server.lock:
+            stats = {
+                'requests': server.requests,
+                'bytes': server.bytes_sent,
+                'not_modified': server.not_modified
+            }
+        data = json.dumps(stats).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def paginate(self, path, params, items, paged):
+        per_page = min(int(params.get('per_page', 30)), 100)
+        page = int(params.get('page', 1))
+        last = max(1, (len(items) + per_page - 1) // per_page)
+        result = items[(page - 1) * per_page:page * per_page]
+        if paged == 'search':
+            result = {
+                'total_count': len(items),
+                'incomplete_results': False,
+                'items': result
+            }
+
+        links = []
+        base = 'http://{}{}'.format(self.headers['Host'], path)
+        if page < last:
+            for rel, number in [('next', page + 1), ('last', last)]:
+                query = dict(params)
+                query['page'] = number
+                links.append('<{}?{}>; rel="{}"'.format(
+                    base, urlencode(query), rel))
+        return result, links
+
+    def send(self, status, result, links):
+        server = self.server
+        data = json.dumps(result).encode('utf-8')
+        etag = '"{}"'.format(hashlib.md5(
+            data + ''.join(links).encode('utf-8')).hexdigest())
+
+        with server.lock:
+            server.requests += 1
+            if self.headers.get('If-None-Match') == etag:
+                status = 304
+                server.not_modified += 1
+            else:
+                server.remaining = max(0, server.remaining - 1)
+            remaining = server.remaining
+
+        if status == 304:
+            data = b''
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('ETag', etag)
+        self.send_header('X-RateLimit-Limit', '5000')
+        self.send_header('X-RateLimit-Remaining', str(remaining))
+        self.send_header('X-RateLimit-Reset', str(server.reset))
+        self.send_header('X-Poll-Interval', '60')
+        if links:
+            self.send_header('Link', ', '.join(links))
+        self.end_headers()
+        self.wfile.write(data)
+
+        with server.lock:
+            server.bytes_sent += len(data)
+
+
+def route(server, method, path, params, body):
+    org = server.org
+    base = 'http://{}'.format(server.host)
+
+    match = re.match(r'^/orgs/([^/]+)$', path)
+    if match:
+        return 200, {
+            'login': org.name,
+            'repos_url': '{}/orgs/{}/repos'.format(base, org.name)
+        }, None
+
+    match = re.match(r'^/orgs/([^/]+)/repos$', path)
+    if match:
+        return 200, org.repos, 'list'
+
+    match = re.match(r'^/repos/([^/]+)/([^/]+)/milestones$', path)
+    if match and match.group(2) in org.milestones:
+        milestones = org.milestones[match.group(2)]
+        state = params.get('state', 'open')
+        return 200, [milestone for milestone in milestones
+                     if state == 'all' or milestone['state'] == state], 'list'
+
+    match = re.match(r'^/repos/([^/]+)/([^/]+)/issues/(\d+)$', path)
+    if match and method == 'patch':
+        return 200, {
+            'number': int(match.group(3)),
+            'body': json.loads(body.decode('utf-8'))['body']
+        }, None
+
+    match = re.match(r'^/repos/([^/]+)/([^/]+)/issues$', path)
+    if match and match.group(2) in org.issues:
+        issues = filter_issues(org.issues[match.group(2)], params)
+        return 200, issues, 'list'
+
+    match = re.match(r'^/orgs/([^/]+)/events$', path)
+    if match:
+        return 200, org.feed, 'list'
+
+    match = re.match(r'^/repos/([^/]+)/([^/]+)/events$', path)
+    if match and match.group(2) in org.events:
+        return 200, org.events[match.group(2)], 'list'
+
+    if path == '/search/issues':
+        return 200, search_issues(org, params['q']), 'search'
+
+    return 404, {
+        'message': 'Not Found',
+        'documentation_url': 'https://docs.github.com/rest'
+    }, None
+
+
+def filter_issues(issues, params):
+    state = params.get('state', 'open')
+    milestone = params.get('milestone')
+    since = params.get('since')
+
+    result = []
+    for issue in reversed(issues):
+        if state != 'all' and issue['state'] != state:
+            continue
+        if milestone == 'none' and issue['milestone'] is not None:
+            continue
+        if milestone not in (None, '*', 'none') and \
+                (issue['milestone'] is None or
+                 str(issue['milestone']['number']) != milestone):
+            continue
+        if since is not None and issue['updated_at'] < since:
+            continue
+        result.append(issue)
+    return result
+
+
+def search_issues(org, query):
+    terms = re.findall(r'(\w+):(>=|<=|>|<)?("[^"]*"|\S+)', query)
+    archived = ('archived', '', 'false') in terms
+    result = []
+    for repo in org.repos:
+        if archived and repo['archived']:
+            continue
+        for issue in reversed(org.issues[repo['name']]):
+            if match_issue(issue, terms):
+                result.append(issue)
+    return result
+
+
+def match_issue(issue, terms):
+    for key, op, value in terms:
+        value = value.strip('"')
+        if key == 'milestone':
+            if issue['milestone'] is None or \
+                    issue['milestone']['title'] != value:
+                return False
+        elif key == 'is' and value in ('open', 'closed'):
+            if issue['state'] != value:
+                return False
+        elif key in ('closed', 'updated', 'created'):
+            stamp = issue['{}_at'.format(key)]
+            if stamp is None or not compare(stamp[:len(value)], op, value):
+                return False
+    return True
+
+
+def compare(left, op, right):
+    if op == '>=':
+        return left >= right
+    if op == '>':
+        return left > right
+    if op == '<=':
+        return left <= right
+    if op == '<':
+        return left < right
+    return left == right
+
+
+def serve(org, port=0, latency=0.0):
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    server.daemon_threads = True
+    server.org = org
+    server.host = '127.0.0.1:{}'.format(server.server_address[1])
+    server.latency = latency
+    server.lock = threading.Lock()
+    server.requests = 0
+    server.bytes_sent = 0
+    server.not_modified = 0
+    server.remaining = 5000
+    server.reset = int(time.time()) + 3600
+    return server
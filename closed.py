@@ -1,26 +1,144 @@
 import sys
 import argparse
 import traceback
-from util.github import GitHub
+from concurrent.futures import ThreadPoolExecutor
+from util.client import fetch_organizations, make_github, \
+    make_repo_filter, save_repo_filters
+from util.github import project_issue
 from util.builder import Builder
 
 
+def fetch_repo(github, organization, days, since, repo):
+    # since on the issues endpoint filters on updated time, so anything
+    # touched lately comes back too and has to be dropped here
+    return [issue for issue in github.iter_closed_issues(organization,
+                                                         repo['name'],
+                                                         days,
+                                                         project=project_issue)
+            if issue['closed_at'] is not None and issue['closed_at'] >= since]
+
+
+def fetch_bulk(github, organization, days):
+    repos = {}
+
+    # One search covers every repository in the organization
+    for issue in github.iter_org_closed_issues(organization, days,
+                                               project=project_issue):
+        repo_name = issue['repository_url'].split('/')[-1]
+        if repo_name not in repos:
+            repos[repo_name] = []
+        repos[repo_name].append(issue)
+
+    results = []
+    for repo_name in sorted(repos):
+        results.append((repo_name, repos[repo_name]))
+
+    return results
+
+
+def write(outputs, text):
+    for out in outputs:
+        out.write(text + '\n')
+
+
+def write_results(outputs, results):
+    for repo_name, issues in results:
+        if len(issues) == 0:
+            continue
+
+        write(outputs, '\n### {}\n'.format(repo_name))
+        for issue in issues:
+            write(outputs, '- [#{}]({}) - {} {}'.format(
+                issue['number'],
+                issue['html_url'],
+                issue['title'],
+                issue['closed_at']
+            ))
+
+
+def iter_organization(github, args, organization, repo_filter=None):
+    if args.bulk:
+        yield from fetch_bulk(github, organization, args.days)
+        return
+
+    # Get our organization
+    org = github.get_org(organization)
+
+    # Get a list of repositories in the organization
+    repos = github.get_repos(org)
+    repos = sorted(repos, key=lambda k: k['name'])
+
+    # Leave out repositories that cannot have closed anything
+    if repo_filter is not None:
+        repos = repo_filter.filter(repos)
+
+    # map() yields in submission order so the report stays in repository
+    # order
+    since = github.get_since(args.days)
+    with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as executor:
+        results = executor.map(
+            lambda repo: fetch_repo(github, organization, args.days, since,
+                                    repo),
+            repos)
+
+        for repo, issues in zip(repos, results):
+            if repo_filter is not None:
+                repo_filter.record(repo, len(issues) > 0)
+            yield repo['name'], issues
+
+
+def fetch_shard(github, args, organization, profiler):
+    repo_filter = make_repo_filter(args, organization,
+                                   'closed:{}'.format(args.days))
+    results = [('{}/{}'.format(organization, repo_name), issues)
+               for repo_name, issues in iter_organization(github, args,
+                                                          organization,
+                                                          repo_filter)]
+    return results, repo_filter
+
+
 def main():
     try:
         parser = argparse.ArgumentParser(description='Multiple Issue '
                                          'Tracker by Milestone on GitHub')
+        parser.add_argument('--bulk', '-b',
+                            action='store_true',
+                            help='Find closed issues with one organization '
+                            'wide search instead of scanning every '
+                            'repository.')
+        parser.add_argument('--concurrency', '-c',
+                            type=int,
+                            default=4,
+                            help='Number of repositories to fetch at once. '
+                            '(Default: 4)')
         parser.add_argument('--days', '-d',
                             required=True,
                             help='Days since last update.')
         parser.add_argument('--file', '-f',
                             required=True,
                             help='Write markdown to local file.')
+        parser.add_argument('--no-cache',
+                            action='store_true',
+                            help='Do not read or write the local response '
+                            'cache.')
         parser.add_argument('--organization', '-o',
+                            action='append',
                             required=True,
-                            help='Organization to scan. (Required)')
+                            help='Organization to scan. May be repeated to '
+                            'combine several organizations in one report. '
+                            '(Required)')
         parser.add_argument('--password', '-p',
                             required=True,
                             help='Your GitHub password. (Required)')
+        parser.add_argument('--prefetch',
+                            action='store_true',
+                            help='Fetch all pages of a listing at once '
+                            'when GitHub reports the last page.')
+        parser.add_argument('--skip-quiet',
+                            action='store_true',
+                            help='Skip repositories that had nothing to '
+                            'report last run and have not changed since. '
+                            'May miss changes for up to a day.')
         parser.add_argument('--timezone', '-t',
                             help='Timezone from the Olson database. '
                             '(https://en.wikipedia.org/wiki/List_of_'
@@ -31,37 +149,31 @@ def main():
 
         args = parser.parse_args()
 
-        github = GitHub(args.username, args.password, args.timezone)
-
-        # Get our organization
-        org = github.get_org(args.organization)
-
-        # Get a list of repositories in the organization
-        repos = github.get_repos(org)
-        repos = sorted(repos, key=lambda k: k['name'])
-
-        for repo in repos:
-            # Get a list of issues in this milestone
-            issues = github.get_closed_issues(args.organization,
-                                       repo['name'], args.days)
-
-            if len(issues) > 0:
-                print('\n### {}\n'.format(repo['name']))
-                for issue in issues:
-                    print('- [#{}](https://github.com/azurestandard/{}/issues/{}) - {} {}'.format(
-                        issue['number'],
-                        repo['name'],
-                        issue['number'],
-                        issue['title'],
-                        issue['closed_at']
-                    ))
-
-
-        # Write out the closed items to a file
-        #if args.file is not None:
-        #    with open(args.file, 'w') as out:
-        #        out.truncate()
-        #        out.write(markdown)
+        organizations = args.organization
+
+        # Print closed issues and write them out as each repository arrives
+        with open(args.file, 'w') as out:
+            outputs = [sys.stdout, out]
+
+            if len(organizations) == 1:
+                github = make_github(args)
+                repo_filter = make_repo_filter(args, organizations[0],
+                                               'closed:{}'.format(args.days))
+                repo_filters = [repo_filter]
+                write_results(outputs, iter_organization(github, args,
+                                                         organizations[0],
+                                                         repo_filter))
+            else:
+                # One process per organization; each report is written as
+                # soon as it and every organization before it are done
+                repo_filters = []
+                for (results, repo_filter), profiler in fetch_organizations(
+                        fetch_shard, args, organizations):
+                    write_results(outputs, results)
+                    repo_filters.append(repo_filter)
+
+        # Only remember which repositories were quiet once the report is out
+        save_repo_filters(repo_filters)
 
     except:
         print('\n')
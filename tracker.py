@@ -1,31 +1,419 @@
 import sys
+import json
+import time
 import argparse
+import threading
 import traceback
-from util.github import GitHub
+from datetime import date
+from concurrent.futures import ThreadPoolExecutor
+from util.client import fetch_organizations, make_github, \
+    make_repo_filter, save_repo_filters
+from util.github import project_issue
 from util.builder import Builder
+from util.profiler import Profiler
+from util.snapshot import Snapshot
+from util.webhook import Receiver, TrackerState
+
+
+def fetch_repo(github, organization, snapshots, repo):
+    results = []
+    updated = {}
+
+    # Get a list of milestones in the repository
+    milestones = github.get_milestones(organization, repo['name'])
+
+    for milestone in milestones:
+        if milestone['title'] in snapshots:
+            snapshot = snapshots[milestone['title']]
+
+            # Get a list of issues in this milestone
+            if snapshot is None:
+                issues = github.get_issues(organization,
+                                           repo['name'],
+                                           milestone['number'],
+                                           project=project_issue)
+            else:
+                # The repository's updated issues are listed once for all
+                # of the milestones tracked in it
+                issues = snapshot.get_issues(github,
+                                             organization,
+                                             repo['name'],
+                                             milestone,
+                                             updated)
+            results.append((milestone, issues))
+
+    return results
+
+
+def fetch_bulk(github, organization, milestone_filter):
+    repos = {}
+
+    # Search finds every issue in the milestone across the organization, so
+    # we never have to list milestones repository by repository
+    issues = github.iter_milestone_issues(organization, milestone_filter,
+                                          project=project_issue)
+
+    for issue in issues:
+        milestone = issue['milestone']
+        if milestone is None or \
+                milestone['title'] != milestone_filter or \
+                milestone['state'] != 'open':
+            continue
+
+        repo_name = issue['repository_url'].split('/')[-1]
+        if repo_name not in repos:
+            repos[repo_name] = (milestone, [])
+        repos[repo_name][1].append(issue)
+
+    results = []
+    for repo_name in sorted(repos):
+        milestone, issues = repos[repo_name]
+        results.append((repo_name, milestone, issues))
+
+    return results
+
+
+def discover(github, organization, repo_filter=None):
+    # Get our organization
+    org = github.get_org(organization)
+
+    # Get a list of repositories in the organization
+    repos = github.get_repos(org)
+    repos = sorted(repos, key=lambda k: k['name'])
+
+    # Leave out repositories that cannot have anything to track
+    if repo_filter is not None:
+        repos = repo_filter.filter(repos)
+    return repos
+
+
+def iter_results(github, organization, milestone_filters, repos, snapshots,
+                 concurrency, bulk, profiler, repo_filter=None):
+    if bulk:
+        for milestone_filter in milestone_filters:
+            with profiler.phase('search'):
+                results = fetch_bulk(github, organization, milestone_filter)
+
+            for repo_name, milestone, issues in results:
+                yield milestone_filter, repo_name, milestone, issues
+        return
+
+    # Fetch milestones and issues for several repositories at once.  Every
+    # repository is scanned once for all tracked milestones.  map() yields
+    # in submission order so the report matches a serial run exactly.
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = executor.map(
+            lambda repo: fetch_repo(github, organization, snapshots, repo),
+            repos)
+
+        for repo in repos:
+            # Only the wait is fetch time, whatever the consumer does with
+            # the result is timed by its own phases
+            with profiler.phase('fetch'):
+                result = next(results)
+
+            if repo_filter is not None:
+                repo_filter.record(repo, len(result) > 0)
+
+            for milestone, issues in result:
+                if len(issues) > 0:
+                    yield milestone['title'], repo['name'], milestone, issues
+
+
+def build(organization, milestone_filters, results, profiler):
+    # One Builder per milestone, shared by trackers that repeat one
+    builds = {}
+    for milestone_filter in milestone_filters:
+        builds[milestone_filter] = Builder(milestone_filter, organization)
+
+    for milestone_filter, repo_name, milestone, issues in results:
+        with profiler.phase('aggregate'):
+            builds[milestone_filter].add_issues(repo_name, issues, milestone)
+
+    return builds
+
+
+def render(trackers, builds, username, profiler, published=None):
+    updates = []
+    for index, tracker in enumerate(trackers):
+        with profiler.phase('render'):
+            build = builds[tracker['milestone']]
+            body = build.get_body()
+
+            # Watch mode skips trackers whose report has not changed since
+            # it was last published
+            if published is not None and published.get(index) == body:
+                continue
+            markdown = body + build.get_footer(username)
+
+        updates.append((index, tracker, body, markdown))
+    return updates
+
+
+def send(github, updates, profiler, published=None):
+    for index, tracker, body, markdown in updates:
+        # Update our tracking issue
+        with profiler.phase('publish'):
+            github.update_issue(markdown, '{}'.format(tracker['issue']))
+
+        # Write out the issue text to a file
+        if tracker.get('file') is not None:
+            with profiler.phase('write'):
+                with open(tracker['file'], 'w') as out:
+                    out.truncate()
+                    out.write(markdown)
+
+        if published is not None:
+            published[index] = body
+
+
+def publish(github, trackers, builds, username, profiler, published=None):
+    send(github, render(trackers, builds, username, profiler, published),
+         profiler, published)
+
+
+def make_snapshots(args, organization, milestone_filters):
+    # Watch mode polls the milestone listings themselves, which come back
+    # as free 304s while unchanged.  A since query is new on every poll.
+    snapshots = {}
+    for milestone_filter in milestone_filters:
+        snapshots[milestone_filter] = None
+        if not args.bulk and not args.watch:
+            snapshots[milestone_filter] = Snapshot(organization,
+                                                   milestone_filter,
+                                                   full=args.full)
+    return snapshots
+
+
+def save_snapshots(snapshots):
+    for snapshot in snapshots.values():
+        if snapshot is not None:
+            snapshot.save()
+
+
+def make_filter(args, organization, milestone_filters):
+    # Watch and webhook mode only discover repositories once, so a repo
+    # skipped as unchanged would stay skipped for the whole session
+    once = args.full or args.watch or args.webhook is not None
+    return make_repo_filter(args, organization,
+                            'tracker:{}'.format(
+                                '|'.join(sorted(milestone_filters))),
+                            skip_quiet=not once)
+
+
+def qualify(organization, results):
+    # Repository names are only unique within an organization
+    for milestone_filter, repo_name, milestone, issues in results:
+        yield (milestone_filter, '{}/{}'.format(organization, repo_name),
+               milestone, issues)
+
+
+def fetch_shard(github, args, organization, profiler, milestone_filters):
+    snapshots = make_snapshots(args, organization, milestone_filters)
+    repo_filter = make_filter(args, organization, milestone_filters)
+
+    repos = []
+    if not args.bulk:
+        with profiler.phase('discovery'):
+            repos = discover(github, organization, repo_filter)
+
+    builds = build(organization,
+                   milestone_filters,
+                   qualify(organization,
+                           iter_results(github,
+                                        organization,
+                                        milestone_filters,
+                                        repos,
+                                        snapshots,
+                                        max(1, args.concurrency),
+                                        args.bulk,
+                                        profiler,
+                                        repo_filter)),
+                   profiler)
+
+    return builds, snapshots, repo_filter
+
+
+def merge_organizations(args, organizations, milestone_filters, profiler):
+    builds = {}
+    for milestone_filter in milestone_filters:
+        builds[milestone_filter] = Builder(milestone_filter,
+                                           ', '.join(organizations))
+
+    snapshots = {}
+    repo_filters = []
+    shards = fetch_organizations(fetch_shard, args, organizations,
+                                 milestone_filters)
+    for organization, shard in zip(organizations, shards):
+        (shard_builds, shard_snapshots, repo_filter), shard_profiler = shard
+        repo_filters.append(repo_filter)
+        with profiler.phase('merge'):
+            for milestone_filter in milestone_filters:
+                builds[milestone_filter].merge(shard_builds[milestone_filter])
+                snapshots[(organization, milestone_filter)] = \
+                    shard_snapshots[milestone_filter]
+        profiler.merge(shard_profiler)
+
+    return builds, snapshots, repo_filters
+
+
+def print_profile(profiler, kind):
+    if kind == 'json':
+        print(profiler.get_json())
+    elif kind == 'text':
+        print(profiler.get_text())
+
+
+def watch(github, args, organization, trackers, milestone_filters, repos,
+          snapshots, concurrency, profiler):
+    last = None
+    published = {}
+    while True:
+        try:
+            results = list(iter_results(github,
+                                        organization,
+                                        milestone_filters,
+                                        repos,
+                                        snapshots,
+                                        concurrency,
+                                        args.bulk,
+                                        profiler))
+
+            # Unchanged listings come back from the cache, so most polls
+            # find the same results and skip the rebuild.  A new day still
+            # rebuilds since due dates are shown relative to today.
+            state = (date.today(), results)
+            if state != last:
+                builds = build(organization, milestone_filters,
+                               results, profiler)
+                publish(github, trackers, builds, args.username, profiler,
+                        published)
+                last = state
+
+            print_profile(profiler, args.profile)
+
+        except Exception:
+            # Keep watching through errors, the next poll may succeed
+            print('\n')
+            traceback.print_exc(file=sys.stdout)
+            print('\n')
+
+        time.sleep(args.interval)
+
+
+def listen(github, args, organization, trackers, milestone_filters, repos,
+           snapshots, concurrency, profiler):
+    # Load every tracked issue once, after that webhooks keep it current
+    state = TrackerState(milestone_filters, organization, github)
+    state.load(iter_results(github,
+                            organization,
+                            milestone_filters,
+                            repos,
+                            snapshots,
+                            concurrency,
+                            args.bulk,
+                            profiler))
+
+    published = {}
+    lock = threading.Lock()
+
+    def refresh():
+        # Only rendering holds up webhook deliveries.  The PATCH can wait
+        # minutes on the rate limit, so it runs after the state is
+        # released, one refresh at a time.
+        with lock:
+            with state.lock:
+                updates = render(trackers, state.builds, args.username,
+                                 profiler, published)
+            send(github, updates, profiler, published)
+
+    refresh()
+
+    with profiler.phase('snapshot'):
+        save_snapshots(snapshots)
+
+    server = Receiver(('', args.webhook), args.secret, state, refresh,
+                      args.debounce)
+    print('Listening for webhooks on port {}'.format(
+        server.server_address[1]))
+    server.serve_forever()
 
 
 def main():
     try:
         parser = argparse.ArgumentParser(description='Multiple Issue '
                                          'Tracker by Milestone on GitHub')
+        parser.add_argument('--bulk', '-b',
+                            action='store_true',
+                            help='Find milestone issues with one '
+                            'organization wide search instead of scanning '
+                            'every repository.')
+        parser.add_argument('--config',
+                            help='JSON file listing several trackers to '
+                            'update in one run. Each entry has a '
+                            '"milestone", an "issue" and an optional '
+                            '"file". Replaces --milestone, --issue and '
+                            '--file.')
+        parser.add_argument('--concurrency', '-c',
+                            type=int,
+                            default=4,
+                            help='Number of repositories to fetch at once. '
+                            '(Default: 4)')
+        parser.add_argument('--debounce',
+                            type=float,
+                            default=5,
+                            help='Seconds to wait for more webhook events '
+                            'before publishing. (Default: 5)')
         parser.add_argument('--file', '-f',
                             help='Write markdown to local file.')
+        parser.add_argument('--full',
+                            action='store_true',
+                            help='Ignore the saved snapshot and repository '
+                            'filter and refetch every issue.')
+        parser.add_argument('--interval',
+                            type=int,
+                            default=60,
+                            help='Seconds between polls with --watch. '
+                            '(Default: 60)')
         parser.add_argument('--issue', '-i',
-                            required=True,
                             help='Reference to GitHub issue to update. '
                             'In the format of {account}/{repository}/'
-                            'issues/{issue number}. (Required)')
+                            'issues/{issue number}. (Required without '
+                            '--config)')
         parser.add_argument('--milestone', '-m',
-                            required=True,
                             help='Milestone to filter on in repos. '
-                            '(Required)')
+                            '(Required without --config)')
+        parser.add_argument('--no-cache',
+                            action='store_true',
+                            help='Do not read or write the local response '
+                            'cache.')
         parser.add_argument('--organization', '-o',
+                            action='append',
                             required=True,
-                            help='Organization to scan. (Required)')
+                            help='Organization to scan. May be repeated to '
+                            'combine several organizations in one report. '
+                            '(Required)')
         parser.add_argument('--password', '-p',
                             required=True,
                             help='Your GitHub password. (Required)')
+        parser.add_argument('--prefetch',
+                            action='store_true',
+                            help='Fetch all pages of a listing at once '
+                            'when GitHub reports the last page.')
+        parser.add_argument('--profile',
+                            nargs='?',
+                            const='text',
+                            choices=['text', 'json'],
+                            help='Print request and phase timings when '
+                            'done, as text (default) or json.')
+        parser.add_argument('--secret',
+                            help='Webhook secret used to verify payload '
+                            'signatures. (Required with --webhook)')
+        parser.add_argument('--skip-quiet',
+                            action='store_true',
+                            help='Skip repositories that had nothing to '
+                            'report last run and have not changed since. '
+                            'May miss changes for up to a day.')
         parser.add_argument('--timezone', '-t',
                             help='Timezone from the Olson database. '
                             '(https://en.wikipedia.org/wiki/List_of_'
@@ -33,45 +421,101 @@ def main():
         parser.add_argument('--username', '-u',
                             required=True,
                             help='Your GitHub username. (Required)')
+        parser.add_argument('--webhook',
+                            type=int,
+                            help='Listen on this port for issues, '
+                            'pull_request and milestone webhooks and '
+                            'republish as they arrive.')
+        parser.add_argument('--watch', '-w',
+                            action='store_true',
+                            help='Keep running and republish the tracking '
+                            'issues whenever a milestone or issue '
+                            'changes.')
 
         args = parser.parse_args()
 
-        github = GitHub(args.username, args.password, args.timezone)
-        build = Builder(args.milestone, args.organization)
+        if args.config is not None:
+            with open(args.config) as config:
+                trackers = json.load(config)
+        elif args.milestone is None or args.issue is None:
+            parser.error('--milestone and --issue are required without '
+                         '--config')
+        else:
+            trackers = [{
+                'milestone': args.milestone,
+                'issue': args.issue,
+                'file': args.file
+            }]
 
-        # Get our organization
-        org = github.get_org(args.organization)
+        if args.webhook is not None and args.secret is None:
+            parser.error('--secret is required with --webhook')
 
-        # Get a list of repositories in the organization
-        repos = github.get_repos(org)
-        repos = sorted(repos, key=lambda k: k['name'])
+        organizations = args.organization
+        if len(organizations) > 1 and \
+                (args.watch or args.webhook is not None):
+            parser.error('--watch and --webhook take a single '
+                         '--organization')
 
-        for repo in repos:
-            # Get a list of milestones in the repository
-            milestones = github.get_milestones(args.organization,
-                                               repo['name'])
+        concurrency = max(1, args.concurrency)
 
-            for milestone in milestones:
-                if milestone['title'] == args.milestone:
-                    # Get a list of issues in this milestone
-                    issues = github.get_issues(args.organization,
-                                               repo['name'],
-                                               milestone['number'])
+        profiler = Profiler()
 
-                    if len(issues) > 0:
-                        # Initialize our Builder
-                        build.add_issues(repo['name'], issues, milestone)
+        github = make_github(args, profiler)
 
-        markdown = build.get_markdown(args.username)
+        milestone_filters = []
+        for tracker in trackers:
+            if tracker['milestone'] not in milestone_filters:
+                milestone_filters.append(tracker['milestone'])
 
-        # Update our tracking issue
-        github.update_issue(markdown, '{}'.format(args.issue))
+        if len(organizations) > 1:
+            # Each organization is fetched in its own process and the
+            # partial reports are merged into one
+            builds, snapshots, repo_filters = merge_organizations(
+                args, organizations, milestone_filters, profiler)
+        else:
+            organization = organizations[0]
+            snapshots = make_snapshots(args, organization,
+                                       milestone_filters)
+            repo_filter = make_filter(args, organization,
+                                      milestone_filters)
+            repo_filters = [repo_filter]
 
-        # Write out the issue text to a file
-        if args.file is not None:
-            with open(args.file, 'w') as out:
-                out.truncate()
-                out.write(markdown)
+            repos = []
+            if not args.bulk:
+                with profiler.phase('discovery'):
+                    repos = discover(github, organization, repo_filter)
+
+            if args.webhook is not None:
+                return listen(github, args, organization, trackers,
+                              milestone_filters, repos, snapshots,
+                              concurrency, profiler)
+
+            if args.watch:
+                return watch(github, args, organization, trackers,
+                             milestone_filters, repos, snapshots,
+                             concurrency, profiler)
+
+            builds = build(organization,
+                           milestone_filters,
+                           iter_results(github,
+                                        organization,
+                                        milestone_filters,
+                                        repos,
+                                        snapshots,
+                                        concurrency,
+                                        args.bulk,
+                                        profiler,
+                                        repo_filter),
+                           profiler)
+
+        publish(github, trackers, builds, args.username, profiler)
+
+        # Only remember this run once the tracking issues are up to date
+        with profiler.phase('snapshot'):
+            save_snapshots(snapshots)
+            save_repo_filters(repo_filters)
+
+        print_profile(profiler, args.profile)
 
     except:
         print('\n')
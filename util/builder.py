@@ -1,6 +1,62 @@
-import operator
+import io
+import bisect
 from datetime import datetime
-from util.github import GITHUB_DATE_FORMAT
+from util.dates import format_day, get_day, parse_timestamp
+
+
+class Issue:
+    __slots__ = ('key', 'repo', 'state', 'type', 'number', 'url', 'title',
+                 'labels', 'label_keys', 'assignee', 'opened_day',
+                 'closed_day', 'date_string')
+
+    def __init__(self, repo_name, issue):
+        self.repo = repo_name
+        self.state = issue['state']
+        self.number = issue['number']
+        self.url = issue['html_url']
+        self.title = issue['title']
+
+        self.type = 'Issue'
+        if 'pull_request' in issue:
+            self.type = 'Pull'
+
+        self.assignee = 'unassigned'
+        if issue['assignee'] is not None:
+            self.assignee = issue['assignee']['login']
+
+        names = [label['name'] for label in issue['labels']]
+        self.labels = ', '.join('`{}`'.format(name) for name in names)
+        self.label_keys = [name.lower() for name in names]
+        if len(self.label_keys) == 0:
+            self.label_keys = ['none']
+
+        self.opened_day = None
+        if issue['created_at'] is not None:
+            self.opened_day = get_day(issue['created_at'])
+
+        self.closed_day = None
+        if issue['closed_at'] is not None:
+            self.closed_day = get_day(issue['closed_at'])
+
+        self.date_string = ''
+        if issue['closed_at'] is not None:
+            self.date_string = 'Closed: {}'.format(
+                format_day(issue['closed_at']))
+        elif issue['created_at'] is not None:
+            self.date_string = 'Opened: {}'.format(
+                format_day(issue['created_at']))
+
+        state_order = 'a'
+        if self.state == 'closed':
+            state_order = 'b'
+
+        # Newest first within an assignee, as the issues endpoint returns
+        # them, so an updated issue lands where a rebuild would put it
+        self.key = (repo_name, state_order, self.state, self.assignee,
+                    -self.number)
+
+    def __lt__(self, other):
+        return self.key < other.key
 
 
 class Builder:
@@ -9,170 +65,156 @@ class Builder:
         self.organization = organization
 
         self.issues = []
-        self.assignee_counts = []
-        self.label_counts = []
-        self.repo_counts = []
-        self.day_opened_counts = []
-        self.day_closed_counts = []
-        self.milestones = []
+        self.records = {}
+        self.assignee_counts = {}
+        self.label_counts = {}
+        self.repo_counts = {}
+        self.day_opened_counts = {}
+        self.day_closed_counts = {}
+        self.milestones = {}
+        self.repo_numbers = {}
 
     def add_issues(self, repo_name, issues, milestone):
-        self.milestones.append([repo_name, milestone])
+        self.set_milestone(repo_name, milestone)
 
         for issue in issues:
-            issue_type = 'Issue'
-            if 'pull_request' in issue:
-                issue_type = 'Pull'
-
-            assignee = 'unassigned'
-            if issue['assignee'] is not None:
-                assignee = issue['assignee']['login']
-
-            labels = ''
-            first = True
-            if len(issue['labels']) > 0:
-                for label in issue['labels']:
-                    if first:
-                        labels += '`{}`'.format(label['name'])
-                        first = False
-                    else:
-                        labels += ', `{}`'.format(label['name'])
-
-                    self.label_counts = self.add_counts(
-                        self.label_counts,
-                        label['name'].lower(),
-                        issue)
+            self.upsert_issue(repo_name, issue)
+
+    def set_milestone(self, repo_name, milestone):
+        self.milestones[repo_name] = milestone
+
+    def upsert_issue(self, repo_name, issue, milestone=None):
+        if milestone is not None:
+            self.set_milestone(repo_name, milestone)
+
+        self.add_record(Issue(repo_name, issue))
+
+    def add_record(self, record):
+        # An update is a retraction of the old record plus a fresh insert
+        repo_name = record.repo
+        self.remove_issue(repo_name, record.number)
+
+        self.records[(repo_name, record.number)] = record
+        if repo_name not in self.repo_numbers:
+            self.repo_numbers[repo_name] = set()
+        self.repo_numbers[repo_name].add(record.number)
+        bisect.insort(self.issues, record)
+        self.count_issue(record, 1)
+
+    def remove_issue(self, repo_name, number):
+        record = self.records.pop((repo_name, number), None)
+        if record is None:
+            return False
+
+        # Records are unique by key, so the bisect lands right on it
+        index = bisect.bisect_left(self.issues, record)
+        del self.issues[index]
+        self.count_issue(record, -1)
+
+        self.repo_numbers[repo_name].discard(number)
+        if len(self.repo_numbers[repo_name]) == 0:
+            del self.repo_numbers[repo_name]
+        return True
+
+    def remove_repo(self, repo_name):
+        numbers = list(self.repo_numbers.get(repo_name, []))
+        for number in numbers:
+            self.remove_issue(repo_name, number)
+        self.milestones.pop(repo_name, None)
+        return len(numbers) > 0
+
+    def merge(self, other):
+        # Fold in a partial Builder, such as one built in another process
+        for repo_name, milestone in other.milestones.items():
+            self.set_milestone(repo_name, milestone)
+        for record in other.records.values():
+            self.add_record(record)
+
+    def get_milestones(self):
+        # Repositories whose issues have all been removed drop out of the
+        # report, but keep their milestone in case issues come back
+        return [(repo_name, self.milestones[repo_name])
+                for repo_name in sorted(self.milestones)
+                if repo_name in self.repo_numbers]
+
+    def count_issue(self, record, step):
+        for key in record.label_keys:
+            self.add_counts(self.label_counts, key, record, step)
+
+        if record.opened_day is not None:
+            self.add_counts(self.day_opened_counts, record.opened_day,
+                            record, step)
+
+        if record.closed_day is not None:
+            self.add_counts(self.day_closed_counts, record.closed_day,
+                            record, step)
+
+        self.add_counts(self.assignee_counts, record.assignee.lower(),
+                        record, step)
+        self.add_counts(self.repo_counts, record.repo.lower(), record, step)
+
+    def add_counts(self, counts, label, record, step=1):
+        value = counts.get(label)
+        if value is None:
+            value = {
+                'issues_open': 0,
+                'issues_closed': 0,
+                'pulls_open': 0,
+                'pulls_closed': 0
+            }
+            counts[label] = value
+
+        if record.state == 'open':
+            if record.type == 'Issue':
+                value['issues_open'] += step
             else:
-                self.label_counts = self.add_counts(
-                    self.label_counts,
-                    'none',
-                    issue)
-
-            created_at = ''
-            if issue['created_at'] is not None:
-                created_at = datetime.strptime(
-                    issue['created_at'],
-                    '%Y-%m-%dT%H:%M:%SZ')
-                self.day_opened_counts = self.add_counts(
-                    self.day_opened_counts,
-                    created_at.strftime('%Y-%m-%d'),
-                    issue)
-
-            closed_at = ''
-            if issue['closed_at'] is not None:
-                closed_at = datetime.strptime(
-                    issue['closed_at'],
-                    '%Y-%m-%dT%H:%M:%SZ')
-                self.day_closed_counts = self.add_counts(
-                    self.day_closed_counts,
-                    closed_at.strftime('%Y-%m-%d'),
-                    issue)
-
-            state_order = 'a'
-            if issue['state'] == 'closed':
-                state_order = 'b'
-
-            self.issues.append(('{}{}{}{}'.format(
-                repo_name,
-                state_order,
-                issue['state'],
-                assignee), {
-                    'repo': repo_name,
-                    'state': issue['state'],
-                    'type': issue_type,
-                    'number': issue['number'],
-                    'url': issue['html_url'],
-                    'title': issue['title'],
-                    'labels': labels,
-                    'assignee': assignee,
-                    'created_at': created_at,
-                    'closed_at': closed_at
-                }
-            ))
-
-            self.assignee_counts = self.add_counts(
-                self.assignee_counts,
-                assignee.lower(),
-                issue)
-
-            self.repo_counts = self.add_counts(
-                self.repo_counts,
-                repo_name.lower(),
-                issue)
-
-    def add_counts(self, counts, label, issue):
-        add_item = True
-        for item in counts:
-            if item['name'] == label:
-                if issue['state'] == 'open':
-                    if 'pull_request' not in issue:
-                        item['counts']['issues_open'] += 1
-                    else:
-                        item['counts']['pulls_open'] += 1
-                else:
-                    if 'pull_request' not in issue:
-                        item['counts']['issues_closed'] += 1
-                    else:
-                        item['counts']['pulls_closed'] += 1
-                add_item = False
-                break
-
-        if add_item:
-            issues_open = 0
-            issues_closed = 0
-            pulls_open = 0
-            pulls_closed = 0
-
-            if issue['state'] == 'open':
-                if 'pull_request' not in issue:
-                    issues_open = 1
-                else:
-                    pulls_open = 1
+                value['pulls_open'] += step
+        else:
+            if record.type == 'Issue':
+                value['issues_closed'] += step
             else:
-                if 'pull_request' not in issue:
-                    issues_closed = 1
-                else:
-                    pulls_closed = 1
+                value['pulls_closed'] += step
 
-            value = {
-                'name': label,
-                'counts': {
-                    'issues_open': issues_open,
-                    'issues_closed': issues_closed,
-                    'pulls_open': pulls_open,
-                    'pulls_closed': pulls_closed
-                }
-            }
-            counts.append(value)
+        # Rows that drop to zero go away, as if never counted
+        if not any(value.values()):
+            del counts[label]
 
         return counts
 
+    def render(self, write, *args, **kwargs):
+        out = io.StringIO()
+        write(out, *args, **kwargs)
+        return out.getvalue()
+
     def get_count_chart(self, counts, label, row_counts=True, col_counts=True):
+        return self.render(self.write_count_chart, counts, label,
+                           row_counts=row_counts, col_counts=col_counts)
+
+    def write_count_chart(self, out, counts, label, row_counts=True,
+                          col_counts=True):
         issues_open = 0
         issues_closed = 0
         pulls_open = 0
         pulls_closed = 0
-        counts = sorted(counts, key=lambda k: k['name'])
         if row_counts:
-            md = ('{} | Issues Opened | Issues Closed | Pulls Open |'
-                  'Pulls Closed | Open Totals | Closed Totals | '
-                  'Totals\n'.format(label))
-            md += ':-- | --: | --: | --: | --: | --: | --: | --:\n'
+            out.write('{} | Issues Opened | Issues Closed | Pulls Open |'
+                      'Pulls Closed | Open Totals | Closed Totals | '
+                      'Totals\n'.format(label))
+            out.write(':-- | --: | --: | --: | --: | --: | --: | --:\n')
         else:
-            md = ('{} | Issues Opened | Issues Closed | Pulls Open |'
-                  'Pulls Closed\n'.format(label))
-            md += ':-- | --: | --: | --: | --:\n'
-        for value in counts:
+            out.write('{} | Issues Opened | Issues Closed | Pulls Open |'
+                      'Pulls Closed\n'.format(label))
+            out.write(':-- | --: | --: | --: | --:\n')
+        for name in sorted(counts):
+            value = counts[name]
             if row_counts:
-                issues_open += value['counts']['issues_open']
-                issues_closed += value['counts']['issues_closed']
-                pulls_open += value['counts']['pulls_open']
-                pulls_closed += value['counts']['pulls_closed']
-
-                total_open = value['counts']['issues_open'] + \
-                    value['counts']['pulls_open']
-                total_closed = value['counts']['issues_closed'] + \
-                    value['counts']['pulls_closed']
+                issues_open += value['issues_open']
+                issues_closed += value['issues_closed']
+                pulls_open += value['pulls_open']
+                pulls_closed += value['pulls_closed']
+
+                total_open = value['issues_open'] + value['pulls_open']
+                total_closed = value['issues_closed'] + value['pulls_closed']
                 total_issues = total_open + total_closed
                 percent_complete = 100
                 if total_closed == 0:
@@ -181,151 +223,128 @@ class Builder:
                     percent_complete = int(
                         round((total_closed / total_issues) * 100))
 
-                md += ('**{}** | {} | {} | {} | {} | **{}** | **{}** |'
-                       '**{}** (*{}*%)\n'.format(
-                           value['name'],
-                           value['counts']['issues_open'],
-                           value['counts']['issues_closed'],
-                           value['counts']['pulls_open'],
-                           value['counts']['pulls_closed'],
-                           total_open,
-                           total_closed,
-                           total_issues,
-                           percent_complete))
+                out.write('**{}** | {} | {} | {} | {} | **{}** | **{}** |'
+                          '**{}** (*{}*%)\n'.format(
+                              name,
+                              value['issues_open'],
+                              value['issues_closed'],
+                              value['pulls_open'],
+                              value['pulls_closed'],
+                              total_open,
+                              total_closed,
+                              total_issues,
+                              percent_complete))
             else:
-                md += '**{}** | {} | {} | {} | {}\n'.format(
-                    value['name'],
-                    value['counts']['issues_open'],
-                    value['counts']['issues_closed'],
-                    value['counts']['pulls_open'],
-                    value['counts']['pulls_closed'])
+                out.write('**{}** | {} | {} | {} | {}\n'.format(
+                    name,
+                    value['issues_open'],
+                    value['issues_closed'],
+                    value['pulls_open'],
+                    value['pulls_closed']))
         if col_counts:
-            md += '**Totals** | **{}** | **{}** | **{}** | **{}** |\n'.format(
-                issues_open,
-                issues_closed,
-                pulls_open,
-                pulls_closed)
-
-        return md
+            out.write('**Totals** | **{}** | **{}** | **{}** | **{}** |\n'
+                      .format(issues_open,
+                              issues_closed,
+                              pulls_open,
+                              pulls_closed))
 
     def get_day_chart(self, counts_opened, counts_closed):
-        counts_opened = sorted(
-            counts_opened,
-            key=lambda k: k['name'],
-            reverse=True)
-        counts_opened = counts_opened[:7]
-
-        counts_closed = sorted(
-            counts_closed,
-            key=lambda k: k['name'],
-            reverse=True)
-        counts_closed = counts_closed[:7]
-
-        counts = []
+        return self.render(self.write_day_chart, counts_opened, counts_closed)
+
+    def write_day_chart(self, out, counts_opened, counts_closed):
+        opened_days = sorted(counts_opened, reverse=True)[:7]
+        closed_days = sorted(counts_closed, reverse=True)[:7]
+
+        out.write('Opened On | Total | <---------- Past 7 Work Day Totals'
+                  ' ----------> | Closed On | Total\n')
+        out.write(':-- | --: | :--: | :-- | --:\n')
         for i in range(7):
             opened_day = None
             opened_total = None
-            if len(counts_opened) > i:
-                opened_day = counts_opened[i]['name']
+            if len(opened_days) > i:
+                opened_day = opened_days[i]
                 opened_total = (
-                    counts_opened[i]['counts']['issues_open'] +
-                    counts_opened[i]['counts']['pulls_open'])
+                    counts_opened[opened_day]['issues_open'] +
+                    counts_opened[opened_day]['pulls_open'])
 
             closed_day = ''
             closed_total = ''
-            if len(counts_closed) > i:
-                closed_day = counts_closed[i]['name']
+            if len(closed_days) > i:
+                closed_day = closed_days[i]
                 closed_total = (
-                    counts_closed[i]['counts']['issues_closed'] +
-                    counts_closed[i]['counts']['pulls_closed'])
-
-            counts.append({
-                'opened_day': opened_day,
-                'opened_total': opened_total,
-                'closed_day': closed_day,
-                'closed_total': closed_total
-            })
-
-        md = ('Opened On | Total | <---------- Past 7 Work Day Totals'
-              ' ----------> | Closed On | Total\n')
-        md += ':-- | --: | :--: | :-- | --:\n'
-        for value in counts:
-            md += '**{}** | {} | | **{}** | {}\n'.format(
-                value['opened_day'],
-                value['opened_total'],
-                value['closed_day'],
-                value['closed_total'])
-
-        return md
+                    counts_closed[closed_day]['issues_closed'] +
+                    counts_closed[closed_day]['pulls_closed'])
+
+            out.write('**{}** | {} | | **{}** | {}\n'.format(
+                opened_day,
+                opened_total,
+                closed_day,
+                closed_total))
 
     def get_issue_detail_listing(self):
-        issues = sorted(self.issues, key=operator.itemgetter(0))
+        return self.render(self.write_issue_detail_listing)
+
+    def write_issue_detail_listing(self, out):
+        # The listing is only published when the last issue is still open
+        if len(self.issues) == 0 or self.issues[-1].state != 'open':
+            return
 
         repo = ''
         state = ''
         assignee = ''
-        md = ''
 
-        for issue in issues:
+        for issue in self.issues:
             high = ''
-            issue = issue[1]
-            if repo != issue['repo']:
-                repo = issue['repo']
+            if repo != issue.repo:
+                repo = issue.repo
                 state = ''
                 assignee = ''
-                md += '\n### {}\n\n'.format(repo)
+                out.write('\n### {}\n\n'.format(repo))
 
-            if state != issue['state']:
-                state = issue['state']
+            if state != issue.state:
+                state = issue.state
                 assignee = ''
-                if issue['state'] == 'open':
-                    md += '- :pencil2: **{}**\n'.format(state)
+                if issue.state == 'open':
+                    out.write('- :pencil2: **{}**\n'.format(state))
                 else:
-                    md += '- :closed_book: **{}**\n'.format(state)
+                    out.write('- :closed_book: **{}**\n'.format(state))
 
-            if assignee != issue['assignee']:
-                assignee = issue['assignee']
-                md += '  - :bust_in_silhouette: **{}**\n'.format(assignee)
+            if assignee != issue.assignee:
+                assignee = issue.assignee
+                out.write('  - :bust_in_silhouette: **{}**\n'.format(
+                    assignee))
 
             box_state = '[ ]'
             strike = ''
-            if issue['state'] == 'closed':
+            if issue.state == 'closed':
                 box_state = '[X]'
                 strike = '~~'
 
-            date_string = ''
-            if issue['closed_at'] != '':
-                date_string = 'Closed: {}'.format(issue['closed_at'].strftime('%m-%d-%Y'))
-            elif issue['created_at'] != '':
-                date_string = 'Opened: {}'.format(issue['created_at'].strftime('%m-%d-%Y'))
-
-            if 'High Priority' in issue['labels']:
+            if 'High Priority' in issue.labels:
                 high = ':fire:'
 
-            md += '    - {} {}{}{} [#{}]({}): {}{}{} - {}\n'.format(
+            out.write('    - {} {}{}{} [#{}]({}): {}{}{} - {}\n'.format(
                 box_state,
                 strike,
                 high,
-                issue['type'],
-                issue['number'],
-                issue['url'],
-                issue['title'],
-                issue['labels'],
+                issue.type,
+                issue.number,
+                issue.url,
+                issue.title,
+                issue.labels,
                 strike,
-                date_string
-                )
-
-        if issue['state'] == 'open':
-            return md
-        else:
-            return ''
+                issue.date_string
+                ))
 
     def get_milestone_totals(self):
+        return self.render(self.write_milestone_totals)
+
+    def write_milestone_totals(self, out):
         percent_complete = 100
         issues_open = 0
         issues_closed = 0
 
-        for milestone in self.milestones:
+        for milestone in self.get_milestones():
             milestone = milestone[1]
             issues_open += int(milestone['open_issues'])
             issues_closed += int(milestone['closed_issues'])
@@ -339,34 +358,33 @@ class Builder:
         if percent_complete == 100:
             party = ' :tada:'
 
-        md = ':checkered_flag: **Percentage Completed:** *{}*%{}\n'.format(
-            percent_complete, party)
-        md += ':pencil2: **Issues Opened:** *{}*\n'.format(
-            issues_open)
-        md += ':closed_book: **Issues Closed:** *{}*\n'.format(
-            issues_closed)
-        md += ':heavy_check_mark: **Issues Total:** *{}*\n\n'.format(
-            issues_total)
-
-        return md
+        out.write(':checkered_flag: **Percentage Completed:** *{}*%{}\n'.format(
+            percent_complete, party))
+        out.write(':pencil2: **Issues Opened:** *{}*\n'.format(
+            issues_open))
+        out.write(':closed_book: **Issues Closed:** *{}*\n'.format(
+            issues_closed))
+        out.write(':heavy_check_mark: **Issues Total:** *{}*\n\n'.format(
+            issues_total))
 
     def get_milestone_detials(self):
-        md = 'Repository | Details\n'
-        md += ':-- | :--\n'
-        for milestone in self.milestones:
+        return self.render(self.write_milestone_detials)
+
+    def write_milestone_detials(self, out):
+        out.write('Repository | Details\n')
+        out.write(':-- | :--\n')
+        for milestone in self.get_milestones():
             repo = milestone[0]
             milestone = milestone[1]
             due_on = None
             if milestone['due_on']:
-                due_on = datetime.strptime(
-                    milestone['due_on'],
-                    GITHUB_DATE_FORMAT)
+                due_on = parse_timestamp(milestone['due_on'])
             description = 'N/A'
             if milestone['description']:
                 description = milestone['description']
-            md += ('**[{}]({})** | :page_facing_up: '
-                   '**Description:** *{}*\n'.format(
-                       repo, milestone['html_url'], description))
+            out.write('**[{}]({})** | :page_facing_up: '
+                      '**Description:** *{}*\n'.format(
+                          repo, milestone['html_url'], description))
             open_issues = milestone['open_issues']
             closed_issues = milestone['closed_issues']
             percent_complete = 100
@@ -380,11 +398,11 @@ class Builder:
             if percent_complete == 100:
                 party = ' :tada:'
 
-            md += (' | :checkered_flag: **Percentage Completed:** '
-                   '*{}*%{}\n'.format(percent_complete, party))
-            md += (' | :pencil2: **Opened:** *{}*\n'.format(
+            out.write(' | :checkered_flag: **Percentage Completed:** '
+                      '*{}*%{}\n'.format(percent_complete, party))
+            out.write(' | :pencil2: **Opened:** *{}*\n'.format(
                 milestone['open_issues']))
-            md += (' | :closed_book: **Closed:** *{}*\n'.format(
+            out.write(' | :closed_book: **Closed:** *{}*\n'.format(
                 milestone['closed_issues']))
             days = 0
             if due_on:
@@ -397,56 +415,67 @@ class Builder:
             elif days > 0:
                 day_text = '{} days from now'.format(days)
             if due_on:
-                md += ' | :calendar: **Due On:** *{}* ({})\n'.format(
-                    due_on.strftime("%B %d, %Y"), day_text)
+                out.write(' | :calendar: **Due On:** *{}* ({})\n'.format(
+                    due_on.strftime("%B %d, %Y"), day_text))
             else:
-                md += ' | :calendar: **Due On:** *N/A*\n'
-            md += ' | \n'
-
-        return md
+                out.write(' | :calendar: **Due On:** *N/A*\n')
+            out.write(' | \n')
 
     def get_markdown(self, username):
-        markdown = '# Overview\n\n'
-        markdown += ('Tracking of `{}`\'s repositories for '
-                     'milestone `{}`.\n\n'.format(
-                         self.organization,
-                         self.milestone_filter))
-        markdown += '### Overall Stats\n\n'
-        markdown += self.get_milestone_totals()
-        markdown += '### Milstone Details by Repository:\n\n'
-        markdown += self.get_milestone_detials()
-        markdown += '\n# Aggregated Data\n\n'
-        markdown += '## :chart: Repositories\n\n'
-        markdown += self.get_count_chart(self.repo_counts, 'Repository')
-        markdown += '\n## :chart: Assignees\n\n'
-        markdown += self.get_count_chart(self.assignee_counts, 'Assignee')
-        markdown += '\n## :chart: Labels\n\n'
-        markdown += self.get_count_chart(self.label_counts,
-                                         'Label',
-                                         col_counts=False)
-        markdown += '\n## :chart: Days\n\n'
-        markdown += self.get_day_chart(self.day_opened_counts,
-                                       self.day_closed_counts)
-        markdown += '\n# Repository Details\n'
-        markdown += self.get_issue_detail_listing()
-        markdown += '\n# Notes\n\n'
-        markdown += ('This issue is automatically updated by a [python script]'
-                     '(https://github.com/azurestandard/issue-milestone-'
-                     'tracker).  This script goes through all `{}` '
-                     'repositories and lists issues under the `{}` '
-                     'milestone.  There is no need to check off '
-                     'individual issues. The script will is manually '
-                     'run to update the issue list periodically. '
-                     'This script will check off closed items.  '
-                     'Comments on this issue will be preserved '
-                     'between updates.\n\n'.format(
-                         self.organization,
-                         self.milestone_filter))
-        markdown += (':calendar: **Last Updated:** *{}* **By:** *{}*.'
-                     '**Via:** [issue-milestone-tracker]'
-                     '(https://github.com/azurestandard/issue-'
-                     'milestone-tracker)'.format(
-                         datetime.now().strftime("%B %d, %Y at %r"),
-                         username))
-
-        return markdown
+        return self.render(self.write_markdown, username)
+
+    def write_markdown(self, out, username):
+        self.write_body(out)
+        self.write_footer(out, username)
+
+    def get_body(self):
+        return self.render(self.write_body)
+
+    def write_body(self, out):
+        out.write('# Overview\n\n')
+        out.write('Tracking of `{}`\'s repositories for '
+                  'milestone `{}`.\n\n'.format(
+                      self.organization,
+                      self.milestone_filter))
+        out.write('### Overall Stats\n\n')
+        self.write_milestone_totals(out)
+        out.write('### Milstone Details by Repository:\n\n')
+        self.write_milestone_detials(out)
+        out.write('\n# Aggregated Data\n\n')
+        out.write('## :chart: Repositories\n\n')
+        self.write_count_chart(out, self.repo_counts, 'Repository')
+        out.write('\n## :chart: Assignees\n\n')
+        self.write_count_chart(out, self.assignee_counts, 'Assignee')
+        out.write('\n## :chart: Labels\n\n')
+        self.write_count_chart(out, self.label_counts, 'Label',
+                               col_counts=False)
+        out.write('\n## :chart: Days\n\n')
+        self.write_day_chart(out, self.day_opened_counts,
+                             self.day_closed_counts)
+        out.write('\n# Repository Details\n')
+        self.write_issue_detail_listing(out)
+        out.write('\n# Notes\n\n')
+        out.write('This issue is automatically updated by a [python script]'
+                  '(https://github.com/azurestandard/issue-milestone-'
+                  'tracker).  This script goes through all `{}` '
+                  'repositories and lists issues under the `{}` '
+                  'milestone.  There is no need to check off '
+                  'individual issues. The script will is manually '
+                  'run to update the issue list periodically. '
+                  'This script will check off closed items.  '
+                  'Comments on this issue will be preserved '
+                  'between updates.\n\n'.format(
+                      self.organization,
+                      self.milestone_filter))
+
+    def get_footer(self, username):
+        return self.render(self.write_footer, username)
+
+    def write_footer(self, out, username):
+        # Kept apart from the body since it changes on every render
+        out.write(':calendar: **Last Updated:** *{}* **By:** *{}*.'
+                  '**Via:** [issue-milestone-tracker]'
+                  '(https://github.com/azurestandard/issue-'
+                  'milestone-tracker)'.format(
+                      datetime.now().strftime("%B %d, %Y at %r"),
+                      username))
@@ -0,0 +1,176 @@
+import json
+import sqlite3
+import threading
+import time
+
+from urllib.parse import parse_qsl, urlsplit
+
+
+class CachedResponse:
+    def __init__(self, url, body, links, headers):
+        self.status_code = 200
+        self.url = url
+        self.links = links
+        self.headers = headers
+        self.text = body
+        self.content = body.encode('utf-8')
+        self.data = None
+
+    def json(self):
+        if self.data is None:
+            self.data = json.loads(self.text)
+        return self.data
+
+
+class ResponseCache:
+    def __init__(self, path='cache.db', ttl=7 * 24 * 60 * 60,
+                 max_size=256 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.cur = self.conn.cursor()
+        self.build()
+        self.expire()
+
+        # Kept as a running total so writes never have to sum the table
+        self.cur.execute('SELECT COALESCE(SUM(size), 0) FROM response')
+        self.size = self.cur.fetchone()[0]
+
+    def build(self):
+        self.cur.execute('CREATE TABLE IF NOT EXISTS response '
+                         '('
+                         'key TEXT PRIMARY KEY, '
+                         'url TEXT, '
+                         'etag TEXT, '
+                         'last_modified TEXT, '
+                         'links TEXT, '
+                         'body TEXT, '
+                         'size INTEGER, '
+                         'stored_at REAL, '
+                         'accessed_at REAL'
+                         ')')
+        self.cur.execute('CREATE INDEX IF NOT EXISTS response_accessed_at '
+                         'ON response(accessed_at)')
+        self.conn.commit()
+
+    def key(self, endpoint, params=None):
+        # A since filter, or a search qualifier built from one, is new on
+        # every run, so a response stored under it would never be read
+        # again.  None tells the client not to cache it.
+        query = dict(parse_qsl(urlsplit(endpoint).query))
+        if params:
+            query.update(params)
+        if 'since' in query or ':>=' in query.get('q', ''):
+            return None
+
+        if not params:
+            return endpoint
+        return '{}?{}'.format(endpoint, json.dumps(params, sort_keys=True))
+
+    def get(self, key):
+        with self.lock:
+            self.cur.execute('SELECT url, etag, last_modified, links, body, '
+                             'stored_at FROM response WHERE key = ?', (key, ))
+            row = self.cur.fetchone()
+            if row is None:
+                return None
+
+            # Anything past its TTL is refetched without validators
+            if row[5] < time.time() - self.ttl:
+                self.delete(key)
+                self.conn.commit()
+                return None
+
+        return {
+            'url': row[0],
+            'etag': row[1],
+            'last_modified': row[2],
+            'links': json.loads(row[3]),
+            'body': row[4]
+        }
+
+    def validators(self, entry):
+        headers = {}
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def response(self, key, entry):
+        # A 304 proves the entry is still current, so its TTL starts over
+        now = time.time()
+        with self.lock:
+            self.cur.execute('UPDATE response SET stored_at = ?, '
+                             'accessed_at = ? WHERE key = ?',
+                             (now, now, key))
+            self.conn.commit()
+
+        headers = {}
+        if entry['etag']:
+            headers['ETag'] = entry['etag']
+        if entry['last_modified']:
+            headers['Last-Modified'] = entry['last_modified']
+        return CachedResponse(entry['url'], entry['body'],
+                              entry['links'], headers)
+
+    def put(self, key, response):
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if etag is None and last_modified is None:
+            return
+
+        body = response.text
+        now = time.time()
+        with self.lock:
+            self.delete(key)
+            self.cur.execute('INSERT OR REPLACE INTO response(key, url, etag, '
+                             'last_modified, links, body, size, stored_at, '
+                             'accessed_at) '
+                             'VALUES(?,?,?,?,?,?,?,?,?'
+                             ')', (key,
+                                   response.url,
+                                   etag,
+                                   last_modified,
+                                   json.dumps(response.links),
+                                   body,
+                                   len(body),
+                                   now,
+                                   now))
+            self.size += len(body)
+            self.evict()
+            self.conn.commit()
+
+    def delete(self, key):
+        self.cur.execute('SELECT size FROM response WHERE key = ?', (key, ))
+        row = self.cur.fetchone()
+        if row is None:
+            return
+        self.cur.execute('DELETE FROM response WHERE key = ?', (key, ))
+        self.size -= row[0]
+
+    def evict(self):
+        if self.size <= self.max_size:
+            return
+
+        # Drop the least recently used responses until we fit again
+        self.cur.execute('SELECT key, size FROM response '
+                         'ORDER BY accessed_at')
+        remove = []
+        for key, size in self.cur.fetchall():
+            if self.size <= self.max_size:
+                break
+            remove.append((key, ))
+            self.size -= size
+        self.cur.executemany('DELETE FROM response WHERE key = ?', remove)
+
+    def expire(self):
+        with self.lock:
+            self.cur.execute('DELETE FROM response WHERE stored_at < ?',
+                             (time.time() - self.ttl, ))
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,55 @@
+from concurrent.futures import ProcessPoolExecutor
+from util.cache import ResponseCache
+from util.github import GitHub
+from util.profiler import Profiler
+from util.repos import RepoFilter
+
+
+def make_github(args, profiler=None):
+    concurrency = max(1, args.concurrency)
+
+    cache = None
+    if not args.no_cache:
+        cache = ResponseCache()
+
+    return GitHub(args.username, args.password, args.timezone,
+                  pool_size=max(10, concurrency),
+                  prefetch=args.prefetch,
+                  cache=cache,
+                  profiler=profiler)
+
+
+def make_repo_filter(args, organization, purpose, skip_quiet=True):
+    # Bulk mode searches instead of listing repositories
+    if args.bulk:
+        return None
+    return RepoFilter(organization, purpose,
+                      skip_quiet=args.skip_quiet and skip_quiet)
+
+
+def save_repo_filters(repo_filters):
+    for repo_filter in repo_filters:
+        if repo_filter is not None:
+            repo_filter.save()
+
+
+def fetch_organization(fetch, args, organization, *extra):
+    # Runs in a worker process with its own client, so every organization
+    # is paced by its own scheduler
+    profiler = Profiler()
+    github = make_github(args, profiler)
+    result = fetch(github, args, organization, profiler, *extra)
+    github.close()
+    return result, profiler
+
+
+def fetch_organizations(fetch, args, organizations, *extra):
+    # One process per organization.  map() yields in organization order,
+    # so the output does not depend on which worker finishes first.
+    count = len(organizations)
+    with ProcessPoolExecutor(max_workers=count) as executor:
+        yield from executor.map(fetch_organization,
+                                [fetch] * count,
+                                [args] * count,
+                                organizations,
+                                *[[value] * count for value in extra])
@@ -1,41 +1,39 @@
 import re
 import sqlite3
 
-from dateutil.parser import parse
-from pytz import timezone
-from util.github import GitHub
+from datetime import datetime, time, timedelta
+from util.dates import get_epoch, get_local_day, get_zone
+from util.github import GitHub, project_event
 
 
 class Event:
-    def __init__(self, row):
-        pacific = timezone('US/Pacific')
-
+    def __init__(self, row, local):
         self.event_id = row[0]
         self.fullname = row[1]
-        self.created_at = parse(row[2]).astimezone(pacific)
-        self.created_date = '{:%m/%d/%Y}'.format(self.created_at)
+        self.created_at = datetime.fromtimestamp(row[2], local)
+        self.created_date = row[3]
         self.created_time = '{:%I:%M%p}'.format(self.created_at)
-        self.month = row[3]
-        self.day = row[4]
-        self.year = row[5]
-        self.time = row[6]
-        self.source = row[7]
-        self.source_id = row[8]
-        self.repo = row[9]
-        self.event = row[10]
-        self.payload_id = row[11]
-        self.action = row[12]
-        self.url = row[13]
-        self.title = row[14]
+        self.repo = row[4]
+        self.event = row[5]
+        self.payload_id = row[6]
+        self.action = row[7]
+        self.url = row[8]
+        self.title = row[9]
 
         def __unicode__(self):
             return '{}: {}'.format(self.event_id, self.title)
 
 
 class Database:
-    def __init__(self, conn, cur):
+    def __init__(self, conn, cur, batch_size=100, timezone=None):
         self.conn = conn
         self.cur = cur
+        self.batch_size = batch_size
+
+        if timezone is None:
+            timezone = 'US/Pacific'
+        self.zone = timezone
+        self.local = get_zone(timezone)
 
     def build(self):
         self.cur.execute('CREATE TABLE IF NOT EXISTS user '
@@ -57,11 +55,114 @@ class Database:
                          'payload_id TEXT, '
                          'action TEXT, '
                          'url TEXT, '
-                         'title TEXT'
+                         'title TEXT, '
+                         'created_epoch INTEGER, '
+                         'created_day TEXT, '
+                         'zone TEXT'
                          ')')
 
-    def populate(self, organization, username, password, timezone):
-        github = GitHub(username, password, timezone)
+        # Older databases predate the precomputed time columns
+        self.cur.execute('PRAGMA table_info(event)')
+        columns = [row[1] for row in self.cur.fetchall()]
+        for column, kind in [('created_epoch', 'INTEGER'),
+                             ('created_day', 'TEXT'),
+                             ('zone', 'TEXT')]:
+            if column not in columns:
+                self.cur.execute('ALTER TABLE event ADD COLUMN {} {}'.format(
+                    column, kind))
+
+        self.cur.execute('CREATE TABLE IF NOT EXISTS poll '
+                         '('
+                         'feed TEXT PRIMARY KEY, '
+                         'polled_at REAL, '
+                         'interval INTEGER'
+                         ')')
+        self.cur.execute('CREATE TABLE IF NOT EXISTS setting '
+                         '('
+                         'name TEXT PRIMARY KEY, '
+                         'value TEXT'
+                         ')')
+        self.cur.execute('CREATE UNIQUE INDEX IF NOT EXISTS user_github '
+                         'ON user(github)')
+        self.cur.execute('CREATE UNIQUE INDEX IF NOT EXISTS event_source_id '
+                         'ON event(source_id)')
+        self.cur.execute('CREATE INDEX IF NOT EXISTS event_created_epoch '
+                         'ON event(created_epoch)')
+        self.conn.commit()
+
+        # New rows are stored with their local day, so the table only has
+        # to be walked when the zone changes or the columns were just added
+        self.cur.execute('SELECT value FROM setting WHERE name = ?',
+                         ('zone', ))
+        row = self.cur.fetchone()
+        if row is None or row[0] != self.zone:
+            self.localize()
+
+    def get_times(self, created_at):
+        epoch = get_epoch(created_at)
+        return (epoch, get_local_day(epoch, self.local), self.zone)
+
+    def localize(self):
+        # Fill in or redo local days for rows stored under another timezone
+        self.cur.execute('SELECT event_id, created_at FROM event '
+                         'WHERE created_epoch IS NULL OR zone IS NOT ?',
+                         (self.zone, ))
+        rows = [self.get_times(row[1]) + (row[0], )
+                for row in self.cur.fetchall()]
+        with self.conn:
+            self.cur.executemany('UPDATE event SET created_epoch = ?, '
+                                 'created_day = ?, zone = ? '
+                                 'WHERE event_id = ?', rows)
+            self.cur.execute('INSERT OR REPLACE INTO setting(name, value) '
+                             'VALUES(?,?)', ('zone', self.zone))
+
+    def get_start(self, days):
+        today = datetime.now(self.local).date()
+        start = self.local.localize(datetime.combine(
+            today - timedelta(days=int(days)), time()))
+        return int(start.timestamp())
+
+    def get_days(self, days):
+        # created_day is stored in local time at ingest, so SQL can group
+        # the range by day.  Events then come off the same index in the
+        # same order, each day's count at a time.
+        self.cur.execute('SELECT strftime(\'%m/%d/%Y\', e.created_day), '
+                         'COUNT(*) '
+                         'FROM event e '
+                         'JOIN user u ON u.user_id = e.user_id '
+                         'WHERE e.created_epoch >= ? '
+                         'GROUP BY e.created_day '
+                         'ORDER BY e.created_day',
+                         (self.get_start(days), ))
+        counts = self.cur.fetchall()
+
+        events = self.get_events(days)
+        for day, count in counts:
+            yield day, [next(events) for i in range(count)]
+
+    def get_events(self, days):
+        self.cur.execute('SELECT e.event_id, '
+                         'COALESCE(u.first_name || \' \' || u.last_name, '
+                         'u.github), '
+                         'e.created_epoch, '
+                         'strftime(\'%m/%d/%Y\', e.created_day), '
+                         'e.repo, e.event, '
+                         'e.payload_id, e.action, e.url, e.title '
+                         'FROM event e '
+                         'JOIN user u ON u.user_id = e.user_id '
+                         'WHERE e.created_epoch >= ? '
+                         'ORDER BY e.created_epoch',
+                         (self.get_start(days), ))
+        for row in self.cur:
+            yield Event(row, self.local)
+
+    def populate(self, organization, username, password, timezone,
+                 feed=False, cache=None, repo_filter=None):
+        github = GitHub(username, password, timezone, cache=cache)
+
+        if feed:
+            self.populate_feed(github, organization)
+            return
 
         # Get our organization
         org = github.get_org(organization)
@@ -70,128 +171,194 @@ class Database:
         repos = github.get_repos(org)
         repos = sorted(repos, key=lambda k: k['name'])
 
+        # Leave out repositories that have been quiet since the last run
+        if repo_filter is not None:
+            repos = repo_filter.filter(repos)
+
+        users = self.get_users()
         for repo in repos:
-            events = github.get_repo_events(organization,
-                                            repo['name'])
+            # Write each batch as it streams in rather than waiting for the
+            # repository's whole event history
+            events = []
+            found = False
+            for event in github.iter_repo_events(organization,
+                                                 repo['name'],
+                                                 project=project_event):
+                events.append(event)
+                found = True
+                if len(events) >= self.batch_size:
+                    self.store_events(repo['name'], events, users)
+                    events = []
+
             if events:
-                for event in events:
-                    # Does the user already exist?
-                    self.cur.execute('SELECT user_id FROM user WHERE github = ?', (event['actor']['login'], ))
-                    row = self.cur.fetchone()
-
-                    user_id = None
-                    if row == None:
-                        self.cur.execute('INSERT INTO user(github) VALUES(?)', (event['actor']['login'], ))
-                        user_id = self.cur.lastrowid
-                        self.conn.commit()
-                    else:
-                        user_id = row[0]
-
-                    type = re.sub('([A-Z])', r' \1', event['type']).lstrip(' ')[:-6]
-                    if type == 'Gollum':
-                        type = 'Wiki'
-
-                    payload_id = None
-                    if 'payload' in event:
-                        if 'number' in event['payload']:
-                            payload_id = event['payload']['number']
-                        if 'pull_request' in event['payload']:
-                            payload_id = event['payload']['pull_request']['number']
-                        if 'issue' in event['payload']:
-                            payload_id = event['payload']['issue']['number']
-                    if type == 'Push':
-                        if 'commits' in event['payload']:
-                            if len(event['payload']['commits']) > 0:
-                                payload_id = event['payload']['commits'][0]['sha']
-                    if type == 'Wiki':
-                        if 'pages' in event['payload']:
-                            payload_id = event['payload']['pages'][0]['sha']
-
-                    action = None
-                    if 'payload' in event:
-                        if 'action' in event['payload']:
-                            action = event['payload']['action'].title()
-                    if type == 'Create':
-                        action = 'Created {}'.format(event['payload']['ref_type'].title())
-                    if type == 'Delete':
-                        action = 'Deleted {}'.format(event['payload']['ref_type'].title())
-                    if type == 'Wiki':
-                        if 'pages' in event['payload']:
-                            action = event['payload']['pages'][0]['action'].title()
-
-                    url = None
-                    if 'payload' in event:
-                        if 'comment' in event['payload']:
-                            url = event['payload']['comment']['html_url']
-                        if 'pull_request' in event['payload']:
-                            url = event['payload']['pull_request']['html_url']
-                        if 'issue' in event['payload']:
-                            url = event['payload']['issue']['html_url']
-                    if type == 'Push':
-                        if 'commits' in event['payload']:
-                            if len(event['payload']['commits']) > 0:
-                                url = event['payload']['commits'][0]['url'].replace('api.', '').replace('repos/', '')
-                    if type == 'Wiki':
-                        if 'pages' in event['payload']:
-                            url = event['payload']['pages'][0]['html_url']
-
-                    title = None
-                    if 'payload' in event:
-                        if 'pull_request' in event['payload']:
-                            title = event['payload']['pull_request']['title']
-                        if 'issue' in event['payload']:
-                            title = event['payload']['issue']['title']
-                    if type == 'Push':
-                        if len(event['payload']['commits']) > 0:
-                            title = '{}: {}'.format(event['payload']['ref'],
-                                                    event['payload']['commits'][0]['message'].split('\n')[0])
-                    if type == 'Create' or type == 'Delete':
-                        title = event['payload']['ref']
-                    if type == 'Wiki':
-                        if 'pages' in event['payload']:
-                            title = event['payload']['pages'][0]['title']
-
-                    self.cur.execute('SELECT event_id FROM event WHERE source_id = ?', (event['id'],))
-                    row = self.cur.fetchone()
-
-                    if row == None:
-                        self.cur.execute('INSERT INTO event(user_id, created_at, source, source_id, repo, event, '
-                                         'payload_id, action, url, title) '
-                                         'VALUES(?,?,?,?,?,?,?,?,?,?'
-                                         ')', (user_id,
-                                               event['created_at'],
-                                               'GitHub',
-                                               event['id'],
-                                               repo['name'],
-                                               type,
-                                               payload_id,
-                                               action,
-                                               url,
-                                               title))
-                        self.conn.commit()
-                    else:
-                        self.cur.execute('UPDATE event SET '
-                                         'user_id = ?, '
-                                         'created_at = ?, '
-                                         'source = ?, '
-                                         'source_id = ?, '
-                                         'repo = ?, '
-                                         'event = ?, '
-                                         'payload_id = ?, '
-                                         'action = ?, '
-                                         'url = ?, '
-                                         'title = ? '
-                                         'WHERE event_id = ?', (user_id,
-                                                                event['created_at'],
-                                                                'GitHub',
-                                                                event['id'],
-                                                                repo['name'],
-                                                                type,
-                                                                payload_id,
-                                                                action,
-                                                                url,
-                                                                title,
-                                                                row[0]))
-                        self.conn.commit()
+                self.store_events(repo['name'], events, users)
+
+            if repo_filter is not None:
+                repo_filter.record(repo, found)
+
+        if repo_filter is not None:
+            repo_filter.save()
 
         return
+
+    def populate_feed(self, github, organization):
+        # GitHub asks feed readers to wait X-Poll-Interval between polls
+        self.cur.execute('SELECT polled_at, interval FROM poll '
+                         'WHERE feed = ?', (organization, ))
+        row = self.cur.fetchone()
+        polled_at = datetime.now().timestamp()
+        if row is not None and polled_at < row[0] + row[1]:
+            return
+
+        # The feed is newest first, so the first event we already have
+        # means everything after it is stored too
+        users = self.get_users()
+        events = []
+        for event in github.iter_org_events(organization,
+                                            project=project_event):
+            if self.has_event(event['id']):
+                break
+            events.append(event)
+            if len(events) >= self.batch_size:
+                self.store_events(None, events, users)
+                events = []
+
+        if events:
+            self.store_events(None, events, users)
+
+        interval = github.poll_interval
+        if interval is None:
+            interval = 60
+        with self.conn:
+            self.cur.execute('INSERT OR REPLACE INTO poll(feed, polled_at, '
+                             'interval) VALUES(?,?,?)',
+                             (organization, polled_at, interval))
+
+    def has_event(self, source_id):
+        self.cur.execute('SELECT 1 FROM event WHERE source_id = ?',
+                         (source_id, ))
+        return self.cur.fetchone() is not None
+
+    def get_users(self):
+        self.cur.execute('SELECT github, user_id FROM user')
+        return dict(self.cur.fetchall())
+
+    def store_events(self, repo_name, events, users):
+        # Write the whole batch in one transaction, so one commit per batch
+        # instead of one per event
+        with self.conn:
+            logins = []
+            for event in events:
+                login = event['actor']['login']
+                if login not in users and login not in logins:
+                    logins.append(login)
+
+            if logins:
+                self.cur.executemany('INSERT INTO user(github) VALUES(?) '
+                                     'ON CONFLICT(github) DO NOTHING',
+                                     [(login, ) for login in logins])
+                self.cur.execute('SELECT github, user_id FROM user '
+                                 'WHERE github IN ({})'.format(
+                                     ','.join('?' * len(logins))), logins)
+                users.update(self.cur.fetchall())
+
+            rows = [self.parse_event(event, repo_name, users)
+                    for event in events]
+            self.cur.executemany('INSERT INTO event(user_id, created_at, '
+                                 'source, source_id, repo, event, '
+                                 'payload_id, action, url, title, '
+                                 'created_epoch, created_day, zone) '
+                                 'VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?) '
+                                 'ON CONFLICT(source_id) DO UPDATE SET '
+                                 'user_id = excluded.user_id, '
+                                 'created_at = excluded.created_at, '
+                                 'source = excluded.source, '
+                                 'repo = excluded.repo, '
+                                 'event = excluded.event, '
+                                 'payload_id = excluded.payload_id, '
+                                 'action = excluded.action, '
+                                 'url = excluded.url, '
+                                 'title = excluded.title, '
+                                 'created_epoch = excluded.created_epoch, '
+                                 'created_day = excluded.created_day, '
+                                 'zone = excluded.zone', rows)
+
+    def parse_event(self, event, repo_name, users):
+        # Feed events come from many repositories and name their own
+        if repo_name is None:
+            repo_name = event['repo']['name'].split('/')[-1]
+
+        type = re.sub('([A-Z])', r' \1', event['type']).lstrip(' ')[:-6]
+        if type == 'Gollum':
+            type = 'Wiki'
+
+        payload_id = None
+        if 'payload' in event:
+            if 'number' in event['payload']:
+                payload_id = event['payload']['number']
+            if 'pull_request' in event['payload']:
+                payload_id = event['payload']['pull_request']['number']
+            if 'issue' in event['payload']:
+                payload_id = event['payload']['issue']['number']
+        if type == 'Push':
+            if 'commits' in event['payload']:
+                if len(event['payload']['commits']) > 0:
+                    payload_id = event['payload']['commits'][0]['sha']
+        if type == 'Wiki':
+            if 'pages' in event['payload']:
+                payload_id = event['payload']['pages'][0]['sha']
+
+        action = None
+        if 'payload' in event:
+            if 'action' in event['payload']:
+                action = event['payload']['action'].title()
+        if type == 'Create':
+            action = 'Created {}'.format(event['payload']['ref_type'].title())
+        if type == 'Delete':
+            action = 'Deleted {}'.format(event['payload']['ref_type'].title())
+        if type == 'Wiki':
+            if 'pages' in event['payload']:
+                action = event['payload']['pages'][0]['action'].title()
+
+        url = None
+        if 'payload' in event:
+            if 'comment' in event['payload']:
+                url = event['payload']['comment']['html_url']
+            if 'pull_request' in event['payload']:
+                url = event['payload']['pull_request']['html_url']
+            if 'issue' in event['payload']:
+                url = event['payload']['issue']['html_url']
+        if type == 'Push':
+            if 'commits' in event['payload']:
+                if len(event['payload']['commits']) > 0:
+                    url = event['payload']['commits'][0]['url'].replace('api.', '').replace('repos/', '')
+        if type == 'Wiki':
+            if 'pages' in event['payload']:
+                url = event['payload']['pages'][0]['html_url']
+
+        title = None
+        if 'payload' in event:
+            if 'pull_request' in event['payload']:
+                title = event['payload']['pull_request']['title']
+            if 'issue' in event['payload']:
+                title = event['payload']['issue']['title']
+        if type == 'Push':
+            if len(event['payload']['commits']) > 0:
+                title = '{}: {}'.format(event['payload']['ref'],
+                                        event['payload']['commits'][0]['message'].split('\n')[0])
+        if type == 'Create' or type == 'Delete':
+            title = event['payload']['ref']
+        if type == 'Wiki':
+            if 'pages' in event['payload']:
+                title = event['payload']['pages'][0]['title']
+
+        return (users[event['actor']['login']],
+                event['created_at'],
+                'GitHub',
+                event['id'],
+                repo_name,
+                type,
+                payload_id,
+                action,
+                url,
+                title) + self.get_times(event['created_at'])
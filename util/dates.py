@@ -0,0 +1,53 @@
+import calendar
+import threading
+import pytz
+
+from datetime import datetime
+
+zones = {}
+zones_lock = threading.Lock()
+
+
+def get_zone(name):
+    # Look each zone up once rather than going through pytz per row
+    zone = zones.get(name)
+    if zone is None:
+        with zones_lock:
+            zone = zones.get(name)
+            if zone is None:
+                zone = pytz.timezone(name)
+                zones[name] = zone
+    return zone
+
+
+def get_fields(value):
+    # GitHub always sends %Y-%m-%dT%H:%M:%SZ, so slicing is enough and
+    # much cheaper than strptime
+    return (int(value[0:4]),
+            int(value[5:7]),
+            int(value[8:10]),
+            int(value[11:13]),
+            int(value[14:16]),
+            int(value[17:19]))
+
+
+def parse_timestamp(value):
+    return datetime(*get_fields(value))
+
+
+def get_epoch(value):
+    return calendar.timegm(get_fields(value))
+
+
+def get_day(value):
+    # Day bucket in UTC, as YYYY-MM-DD
+    return value[:10]
+
+
+def get_local_day(epoch, zone):
+    return '{:%Y-%m-%d}'.format(datetime.fromtimestamp(epoch, zone))
+
+
+def format_day(value):
+    # MM-DD-YYYY, as shown in the detail listing
+    return '{}-{}-{}'.format(value[5:7], value[8:10], value[0:4])
@@ -1,52 +1,356 @@
 import json
-import requests
+import threading
+import time
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+from util.transport import SessionTransport
 
 GITHUB_DATE_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
 
 
+def project_user(user):
+    if user is None:
+        return None
+    return {
+        'login': user['login']
+    }
+
+
+def project_milestone(milestone):
+    if milestone is None:
+        return None
+    return {
+        'number': milestone['number'],
+        'title': milestone['title'],
+        'state': milestone['state'],
+        'description': milestone['description'],
+        'due_on': milestone['due_on'],
+        'html_url': milestone['html_url'],
+        'open_issues': milestone['open_issues'],
+        'closed_issues': milestone['closed_issues']
+    }
+
+
+def project_issue(issue):
+    # Only what the Builder, snapshot and reports read; user objects,
+    # reactions and bodies are dropped as each page arrives
+    value = {
+        'number': issue['number'],
+        'title': issue['title'],
+        'state': issue['state'],
+        'html_url': issue['html_url'],
+        'assignee': project_user(issue['assignee']),
+        'labels': [{'name': label['name']} for label in issue['labels']],
+        'milestone': project_milestone(issue.get('milestone')),
+        'created_at': issue['created_at'],
+        'closed_at': issue['closed_at']
+    }
+    if 'repository_url' in issue:
+        value['repository_url'] = issue['repository_url']
+    if 'pull_request' in issue:
+        value['pull_request'] = {}
+    return value
+
+
+def project_event(event):
+    payload = event.get('payload', {})
+    value = {}
+    for key in ['action', 'number', 'ref', 'ref_type']:
+        if key in payload:
+            value[key] = payload[key]
+    for key in ['issue', 'pull_request']:
+        if key in payload:
+            value[key] = {
+                'number': payload[key]['number'],
+                'html_url': payload[key]['html_url'],
+                'title': payload[key]['title']
+            }
+    if 'comment' in payload:
+        value['comment'] = {
+            'html_url': payload['comment']['html_url']
+        }
+
+    # Only the first commit and wiki page are ever reported
+    if 'commits' in payload:
+        value['commits'] = [{
+            'sha': commit['sha'],
+            'url': commit['url'],
+            'message': commit['message']
+        } for commit in payload['commits'][:1]]
+    if 'pages' in payload:
+        value['pages'] = [{
+            'sha': page['sha'],
+            'action': page['action'],
+            'html_url': page['html_url'],
+            'title': page['title']
+        } for page in payload['pages'][:1]]
+
+    return {
+        'id': event['id'],
+        'type': event['type'],
+        'actor': project_user(event['actor']),
+        'repo': {
+            'name': event['repo']['name']
+        },
+        'created_at': event['created_at'],
+        'payload': value
+    }
+
+
+class Scheduler:
+    def __init__(self, rate=10.0, burst=10, max_retries=5, reserve=0):
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.reserve = reserve
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.remaining = None
+        self.reset = None
+        self.lock = threading.Lock()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+            # Take the token now, even if that puts the bucket in debt, so
+            # waiting threads queue up behind each other
+            self.tokens -= 1
+            wait = 0
+            if self.tokens < 0:
+                wait = -self.tokens / self.rate
+
+            # Out of budget, hold everything until the window resets
+            if self.remaining is not None and \
+                    self.remaining <= self.reserve and \
+                    self.reset is not None:
+                wait = max(wait, self.reset - time.time() + 1)
+
+        if wait > 0:
+            self.sleep(wait)
+
+    def update(self, response):
+        remaining = response.headers.get('X-RateLimit-Remaining')
+        reset = response.headers.get('X-RateLimit-Reset')
+        with self.lock:
+            if remaining is not None:
+                self.remaining = int(remaining)
+            if reset is not None:
+                self.reset = int(reset)
+
+    def retry_delay(self, response, attempt):
+        if attempt >= self.max_retries:
+            return None
+
+        status = response.status_code
+        if status >= 500:
+            return min(2 ** attempt, 60)
+
+        if status not in (403, 429):
+            return None
+
+        retry_after = response.headers.get('Retry-After')
+        if retry_after is not None:
+            return int(retry_after)
+
+        remaining = response.headers.get('X-RateLimit-Remaining')
+        reset = response.headers.get('X-RateLimit-Reset')
+        if remaining == '0' and reset is not None:
+            return max(int(reset) - time.time() + 1, 1)
+
+        # Secondary limits do not always say when to come back, so wait at
+        # least a minute and back off from there
+        if status == 429 or 'rate limit' in response.text.lower():
+            return min(60 * 2 ** attempt, 900)
+
+        return None
+
+
 class GitHub:
-    def __init__(self, username, password, timezone=None):
+    def __init__(self, username, password, timezone=None, transport=None,
+                 pool_size=10, base_url='https://api.github.com',
+                 prefetch=False, prefetch_workers=4, cache=None,
+                 scheduler=None, profiler=None):
         self.username = username
         self.password = password
         self.timezone = timezone
-        self.base_url = 'https://api.github.com'
+        self.base_url = base_url
         self.per_page = 100
+        self.prefetch = prefetch
+        self.prefetch_workers = prefetch_workers
+        self.cache = cache
+        self.executor = None
+        self.poll_interval = None
+
+        if scheduler is None:
+            scheduler = Scheduler()
+        self.scheduler = scheduler
+        self.profiler = profiler
+        self.lock = threading.Lock()
 
-    def call(self, method, endpoint, params=None, data=None):
         if self.timezone is None:
-            headers = {
+            self.headers = {
                 'Accept': 'application/vnd.github.v3+json'
             }
         else:
-            headers = {
+            self.headers = {
                 'Accept': 'application/vnd.github.v3+json',
                 'Time-Zone': self.timezone
             }
 
+        if transport is None:
+            # Prefetch threads draw on the same pool as the caller's, so
+            # they get connections of their own rather than new handshakes
+            if prefetch:
+                pool_size += prefetch_workers
+            transport = SessionTransport(auth=(self.username,
+                                               self.password),
+                                         pool_size=pool_size)
+        self.transport = transport
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        if self.cache is not None:
+            self.cache.close()
+        self.transport.close()
+
+    def request(self, method, endpoint, params=None, data=None):
+        headers = self.headers
+        key = None
+        entry = None
+        if self.cache is not None and method == 'get':
+            key = self.cache.key(endpoint, params)
+            entry = self.cache.get(key)
+            if entry is not None:
+                headers = dict(self.headers)
+                headers.update(self.cache.validators(entry))
+
+        # Every request waits its turn with the shared scheduler and is
+        # retried when GitHub throttles us or has a server error
+        attempt = 0
+        while True:
+            self.scheduler.acquire()
+            start = time.perf_counter()
+            response = self.transport.request(method=method,
+                                              headers=headers,
+                                              url=endpoint,
+                                              params=params,
+                                              data=data)
+            self.scheduler.update(response)
+
+            if self.profiler is not None:
+                self.profiler.record_request(method, endpoint, response,
+                                             time.perf_counter() - start)
+
+            delay = self.scheduler.retry_delay(response, attempt)
+            if delay is None:
+                break
+            self.scheduler.sleep(delay)
+            attempt += 1
+
+        # Event feeds tell us how long to wait before polling them again
+        poll_interval = response.headers.get('X-Poll-Interval')
+        if poll_interval is not None:
+            self.poll_interval = int(poll_interval)
+
+        # Not Modified carries no body and is free against the rate limit
+        if response.status_code == 304 and entry is not None:
+            return self.cache.response(key, entry)
+
+        self.error_check(response)
+
+        if key is not None:
+            self.cache.put(key, response)
+        return response
+
+    def call(self, method, endpoint, params=None, data=None, items_key=None):
         items = []
+        for page in self.iter_pages(method, endpoint, params, data,
+                                    items_key):
+            if type(page) == dict:
+                return page
+            items += page
+        return items
+
+    def iter_call(self, method, endpoint, params=None, items_key=None,
+                  project=None):
+        for page in self.iter_pages(method, endpoint, params,
+                                    items_key=items_key):
+            # Swap the raw page for its projection so the full JSON can be
+            # freed before the next page is requested
+            if project is not None:
+                page = [project(item) for item in page]
+            yield from page
+
+    def iter_pages(self, method, endpoint, params=None, data=None,
+                   items_key=None):
         while True:
-            response = requests.request(method=method,
-                                        auth=(self.username,
-                                              self.password),
-                                        headers=headers,
-                                        url=endpoint,
-                                        params=params,
-                                        data=data)
-
-            self.error_check(response)
-
-            if type(response.json()) == dict:
-                return response.json()
+            response = self.request(method, endpoint, params, data)
+            body = response.json()
+
+            if items_key is not None:
+                body = body[items_key]
+
+            # Drop our reference to the response before handing the page
+            # out so only one raw page is held at a time
+            links = response.links
+            response = None
+            yield body
+
+            if type(body) == dict:
+                return
+
+            if self.prefetch and 'next' in links and 'last' in links:
+                yield from self.prefetch_pages(links, params, items_key)
+                return
+            elif 'next' in links:
+                endpoint = links['next']['url']
+                if self.profiler is not None:
+                    self.profiler.record_page(method, endpoint)
             else:
-                items += response.json()
+                return
 
-                if 'next' in response.links:
-                    endpoint = response.links['next']['url']
-                else:
-                    break
-        return items
+    def prefetch_pages(self, links, params=None, items_key=None):
+        next_url = urlsplit(links['next']['url'])
+        last_url = urlsplit(links['last']['url'])
+        query = parse_qsl(last_url.query)
+        first_page = int(dict(parse_qsl(next_url.query))['page'])
+        last_page = int(dict(query)['page'])
+
+        # Every remaining page URL is known from rel="last", so fetch them
+        # all at once and hand the pages back in order
+        endpoints = []
+        for page in range(first_page, last_page + 1):
+            page_query = [(key, value) for key, value in query
+                          if key != 'page']
+            page_query.append(('page', page))
+            endpoints.append(urlunsplit(
+                last_url._replace(query=urlencode(page_query))))
+            if self.profiler is not None:
+                self.profiler.record_page('get', endpoints[-1])
+
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(
+                    max_workers=self.prefetch_workers)
+
+        for response in self.executor.map(
+                lambda endpoint: self.request('get', endpoint, params),
+                endpoints):
+            if items_key is not None:
+                yield response.json()[items_key]
+            else:
+                yield response.json()
 
     def error_check(self, response):
         if response.status_code != 200:
@@ -63,14 +367,20 @@ class GitHub:
         return self.call('get', endpoint)
 
     def get_repos(self, org):
+        return list(self.iter_repos(org))
+
+    def iter_repos(self, org):
         endpoint = org['repos_url']
         params = {
             'sort': 'full_name',
             'per_page': self.per_page
         }
-        return self.call('get', endpoint, params)
+        return self.iter_call('get', endpoint, params)
 
     def get_milestones(self, org_name, repo_name):
+        return list(self.iter_milestones(org_name, repo_name))
+
+    def iter_milestones(self, org_name, repo_name):
         endpoint = '{}/repos/{}/{}/milestones'.format(
             self.base_url,
             org_name,
@@ -79,35 +389,81 @@ class GitHub:
             'state': 'open',
             'per_page': self.per_page
         }
-        return self.call('get', endpoint, params)
+        return self.iter_call('get', endpoint, params)
+
+    def get_issues(self, org_name, repo_name, milestone_number, since=None,
+                   project=None):
+        return list(self.iter_issues(org_name, repo_name, milestone_number,
+                                     since=since, project=project))
 
-    def get_issues(self, org_name, repo_name, milestone_number):
+    def iter_issues(self, org_name, repo_name, milestone_number, since=None,
+                    project=None):
         endpoint = '{}/repos/{}/{}/issues'.format(
             self.base_url,
             org_name,
             repo_name)
         params = {
             'state': 'all',
-            'milestone': milestone_number,
             'per_page': self.per_page
         }
-        return self.call('get', endpoint, params)
+        if milestone_number is not None:
+            params['milestone'] = milestone_number
+        if since is not None:
+            params['since'] = since
+        return self.iter_call('get', endpoint, params, project=project)
 
-    def get_closed_issues(self, org_name, repo_name, days):
+    def get_milestone_issues(self, org_name, milestone_title, project=None):
+        return list(self.iter_milestone_issues(org_name, milestone_title,
+                                               project=project))
+
+    def iter_milestone_issues(self, org_name, milestone_title, project=None):
+        endpoint = '{}/search/issues'.format(self.base_url)
+        params = {
+            'q': 'org:{} milestone:"{}" archived:false'.format(
+                org_name, milestone_title),
+            'sort': 'created',
+            'order': 'desc',
+            'per_page': self.per_page
+        }
+        return self.iter_call('get', endpoint, params, items_key='items',
+                              project=project)
+
+    def get_since(self, days):
+        since = datetime.utcnow() - timedelta(days=int(days))
+        return since.strftime(GITHUB_DATE_FORMAT)
+
+    def get_closed_issues(self, org_name, repo_name, days, project=None):
+        return list(self.iter_closed_issues(org_name, repo_name, days,
+                                            project=project))
+
+    def iter_closed_issues(self, org_name, repo_name, days, project=None):
         endpoint = '{}/repos/{}/{}/issues'.format(
             self.base_url,
             org_name,
             repo_name)
 
-        since = datetime.now() - timedelta(days=int(days))
-        since = since.strftime(GITHUB_DATE_FORMAT)
-
         params = {
             'state': 'closed',
-            'since': since,
+            'since': self.get_since(days),
+            'per_page': self.per_page
+        }
+        return self.iter_call('get', endpoint, params, project=project)
+
+    def get_org_closed_issues(self, org_name, days, project=None):
+        return list(self.iter_org_closed_issues(org_name, days,
+                                                project=project))
+
+    def iter_org_closed_issues(self, org_name, days, project=None):
+        endpoint = '{}/search/issues'.format(self.base_url)
+        params = {
+            'q': 'org:{} is:closed closed:>={} archived:false'.format(
+                org_name, self.get_since(days)),
+            'sort': 'created',
+            'order': 'desc',
             'per_page': self.per_page
         }
-        return self.call('get', endpoint, params)
+        return self.iter_call('get', endpoint, params, items_key='items',
+                              project=project)
 
     def update_issue(self, markdown, issue):
         endpoint = '{}/repos/{}'.format(self.base_url, issue)
@@ -116,7 +472,11 @@ class GitHub:
         }
         return self.call('patch', endpoint, data=json.dumps(data))
 
-    def get_repo_events(self, org_name, repo_name):
+    def get_repo_events(self, org_name, repo_name, project=None):
+        return list(self.iter_repo_events(org_name, repo_name,
+                                          project=project))
+
+    def iter_repo_events(self, org_name, repo_name, project=None):
         endpoint = '{}/repos/{}/{}/events'.format(
             self.base_url,
             org_name,
@@ -125,4 +485,14 @@ class GitHub:
         params = {
             'per_page': self.per_page
         }
-        return self.call('get', endpoint)
+        return self.iter_call('get', endpoint, params, project=project)
+
+    def get_org_events(self, org_name, project=None):
+        return list(self.iter_org_events(org_name, project=project))
+
+    def iter_org_events(self, org_name, project=None):
+        endpoint = '{}/orgs/{}/events'.format(self.base_url, org_name)
+        params = {
+            'per_page': self.per_page
+        }
+        return self.iter_call('get', endpoint, params, project=project)
@@ -0,0 +1,14 @@
+import threading
+
+
+class LockedState:
+    # Locks cannot be pickled, so a copy sent between processes gets a
+    # fresh one
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
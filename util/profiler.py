@@ -0,0 +1,192 @@
+import json
+import re
+import threading
+import time
+
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from util.locks import LockedState
+
+BUCKETS = [0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0]
+
+
+class Profiler(LockedState):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+        self.phases = {}
+        self.phase_order = []
+        self.first_remaining = None
+        self.last_remaining = None
+        self.lowest_remaining = None
+
+    def get_endpoint(self, method, url):
+        parts = urlsplit(url).path.strip('/').split('/')
+        if len(parts) >= 2 and parts[0] == 'orgs':
+            parts[1] = '{org}'
+        if len(parts) >= 3 and parts[0] == 'repos':
+            parts[1] = '{owner}'
+            parts[2] = '{repo}'
+        parts = [re.sub(r'^\d+$', '{number}', part) for part in parts]
+        return '{} /{}'.format(method.upper(), '/'.join(parts))
+
+    def get_stats(self, key):
+        stats = self.endpoints.get(key)
+        if stats is None:
+            stats = {
+                'requests': 0,
+                'not_modified': 0,
+                'errors': 0,
+                'pages': 0,
+                'bytes': 0,
+                'seconds': 0.0,
+                'max_seconds': 0.0,
+                'histogram': [0] * (len(BUCKETS) + 1)
+            }
+            self.endpoints[key] = stats
+        return stats
+
+    def record_request(self, method, url, response, seconds):
+        key = self.get_endpoint(method, url)
+        remaining = response.headers.get('X-RateLimit-Remaining')
+
+        bucket = len(BUCKETS)
+        for i, limit in enumerate(BUCKETS):
+            if seconds < limit:
+                bucket = i
+                break
+
+        with self.lock:
+            stats = self.get_stats(key)
+            stats['requests'] += 1
+            stats['bytes'] += len(response.content or b'')
+            stats['seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+            stats['histogram'][bucket] += 1
+            if response.status_code == 304:
+                stats['not_modified'] += 1
+            elif response.status_code >= 400:
+                stats['errors'] += 1
+
+            if remaining is not None:
+                remaining = int(remaining)
+                if self.first_remaining is None:
+                    self.first_remaining = remaining
+                if self.lowest_remaining is None or \
+                        remaining < self.lowest_remaining:
+                    self.lowest_remaining = remaining
+                self.last_remaining = remaining
+
+    def record_page(self, method, url):
+        key = self.get_endpoint(method, url)
+        with self.lock:
+            self.get_stats(key)['pages'] += 1
+
+    @contextmanager
+    def phase(self, name):
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.process_time() - cpu
+            with self.lock:
+                if name not in self.phases:
+                    self.phases[name] = {'calls': 0, 'wall': 0.0, 'cpu': 0.0}
+                    self.phase_order.append(name)
+                self.phases[name]['calls'] += 1
+                self.phases[name]['wall'] += wall
+                self.phases[name]['cpu'] += cpu
+
+    def merge(self, other):
+        # Fold in a profile from a worker process.  Workers run side by
+        # side, so merged phase times add up to more than the wall clock.
+        with self.lock:
+            for key, stats in other.endpoints.items():
+                value = self.get_stats(key)
+                for name in ['requests', 'not_modified', 'errors', 'pages',
+                             'bytes', 'seconds']:
+                    value[name] += stats[name]
+                value['max_seconds'] = max(value['max_seconds'],
+                                           stats['max_seconds'])
+                value['histogram'] = [a + b for a, b in
+                                      zip(value['histogram'],
+                                          stats['histogram'])]
+
+            for name in other.phase_order:
+                if name not in self.phases:
+                    self.phases[name] = {'calls': 0, 'wall': 0.0, 'cpu': 0.0}
+                    self.phase_order.append(name)
+                for key in ['calls', 'wall', 'cpu']:
+                    self.phases[name][key] += other.phases[name][key]
+
+            if other.first_remaining is not None:
+                if self.first_remaining is None or \
+                        other.first_remaining > self.first_remaining:
+                    self.first_remaining = other.first_remaining
+                if self.lowest_remaining is None or \
+                        other.lowest_remaining < self.lowest_remaining:
+                    self.lowest_remaining = other.lowest_remaining
+                self.last_remaining = other.last_remaining
+
+    def get_report(self):
+        with self.lock:
+            consumed = None
+            if self.first_remaining is not None:
+                consumed = self.first_remaining - self.lowest_remaining
+
+            return {
+                'phases': [dict(self.phases[name], name=name)
+                           for name in self.phase_order],
+                'endpoints': [dict(self.endpoints[key], endpoint=key)
+                              for key in sorted(self.endpoints)],
+                'buckets': BUCKETS,
+                'rate_limit': {
+                    'first_remaining': self.first_remaining,
+                    'last_remaining': self.last_remaining,
+                    'consumed': consumed
+                }
+            }
+
+    def get_json(self):
+        return json.dumps(self.get_report(), indent=2)
+
+    def get_text(self):
+        report = self.get_report()
+
+        text = '{:<32} {:>6} {:>10} {:>10}\n'.format(
+            'Phase', 'Calls', 'Wall (s)', 'CPU (s)')
+        for phase in report['phases']:
+            text += '{:<32} {:>6} {:>10.3f} {:>10.3f}\n'.format(
+                phase['name'], phase['calls'], phase['wall'], phase['cpu'])
+
+        text += '\n{:<48} {:>8} {:>6} {:>6} {:>12} {:>9} {:>9}\n'.format(
+            'Endpoint', 'Requests', '304s', 'Pages', 'Bytes', 'Avg (ms)',
+            'Max (ms)')
+        for stats in report['endpoints']:
+            average = 0
+            if stats['requests'] > 0:
+                average = stats['seconds'] / stats['requests'] * 1000
+            text += '{:<48} {:>8} {:>6} {:>6} {:>12} {:>9.1f} {:>9.1f}\n'.format(
+                stats['endpoint'],
+                stats['requests'],
+                stats['not_modified'],
+                stats['pages'],
+                stats['bytes'],
+                average,
+                stats['max_seconds'] * 1000)
+
+            labels = ['<{:g}s'.format(limit) for limit in BUCKETS]
+            labels.append('>={:g}s'.format(BUCKETS[-1]))
+            text += '  {}\n'.format(', '.join(
+                '{} {}'.format(label, count)
+                for label, count in zip(labels, stats['histogram'])
+                if count))
+
+        rate_limit = report['rate_limit']
+        if rate_limit['consumed'] is not None:
+            text += '\nRate limit: {} used, {} remaining\n'.format(
+                rate_limit['consumed'], rate_limit['last_remaining'])
+
+        return text
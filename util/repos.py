@@ -0,0 +1,90 @@
+import json
+import os
+import threading
+import time
+
+from util.locks import LockedState
+
+
+class RepoFilter(LockedState):
+    def __init__(self, organization, purpose, path='repos.json',
+                 ttl=24 * 60 * 60, skip_quiet=False, require_issues=True):
+        self.path = path
+        self.key = '{}/{}'.format(organization, purpose)
+        self.ttl = ttl
+        self.skip_quiet = skip_quiet
+        self.require_issues = require_issues
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.repos = {}
+        self.seen = {}
+
+        if skip_quiet:
+            self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path) as cache:
+            data = json.load(cache)
+
+        if self.key in data:
+            self.repos = data[self.key]
+
+    def save(self):
+        if not self.skip_quiet:
+            return
+
+        data = {}
+        if os.path.exists(self.path):
+            with open(self.path) as cache:
+                data = json.load(cache)
+
+        data[self.key] = self.seen
+
+        with open(self.path, 'w') as out:
+            out.truncate()
+            json.dump(data, out)
+
+    def get_fingerprint(self, repo):
+        # Pushes, repository edits and issues opening or closing all move
+        # one of these
+        return [repo.get('pushed_at'),
+                repo.get('updated_at'),
+                repo.get('open_issues_count')]
+
+    def check(self, repo):
+        if repo.get('archived'):
+            return False
+        if self.require_issues and not repo.get('has_issues', True):
+            return False
+
+        # Repos that had nothing for us last time and have not changed
+        # since are skipped, but still rechecked once the entry is old.
+        # Comments, or an issue moving into a milestone, touch none of
+        # the fingerprint, so this is only done when asked for.
+        if not self.skip_quiet:
+            return True
+
+        entry = self.repos.get(repo['name'])
+        if entry is not None and \
+                not entry['match'] and \
+                entry['fingerprint'] == self.get_fingerprint(repo) and \
+                entry['checked_at'] > self.started - self.ttl:
+            with self.lock:
+                self.seen[repo['name']] = entry
+            return False
+
+        return True
+
+    def filter(self, repos):
+        return [repo for repo in repos if self.check(repo)]
+
+    def record(self, repo, match):
+        with self.lock:
+            self.seen[repo['name']] = {
+                'fingerprint': self.get_fingerprint(repo),
+                'match': match,
+                'checked_at': self.started
+            }
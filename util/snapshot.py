@@ -0,0 +1,121 @@
+import json
+import os
+import threading
+
+from datetime import datetime
+from util.github import GITHUB_DATE_FORMAT, project_issue, \
+    project_milestone
+from util.locks import LockedState
+
+
+class Snapshot(LockedState):
+    def __init__(self, organization, milestone_filter, path='snapshot.json',
+                 full=False):
+        self.path = path
+        self.key = '{}/{}'.format(organization, milestone_filter)
+        self.lock = threading.Lock()
+        self.started = datetime.utcnow().strftime(GITHUB_DATE_FORMAT)
+        self.since = None
+        self.repos = {}
+        self.seen = {}
+
+        if not full:
+            self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path) as snapshot:
+            data = json.load(snapshot)
+
+        if self.key in data:
+            self.since = data[self.key]['since']
+            self.repos = data[self.key]['repos']
+
+    def save(self):
+        data = {}
+        if os.path.exists(self.path):
+            with open(self.path) as snapshot:
+                data = json.load(snapshot)
+
+        # Repos that no longer carry the milestone simply drop out
+        data[self.key] = {
+            'since': self.started,
+            'repos': self.seen
+        }
+
+        with open(self.path, 'w') as out:
+            out.truncate()
+            json.dump(data, out)
+
+    def project(self, issue):
+        return self.strip(project_issue(issue))
+
+    def strip(self, issue):
+        # The milestone and repository are implied by where it is stored
+        value = dict(issue)
+        del value['milestone']
+        value.pop('repository_url', None)
+        return value
+
+    def get_all_issues(self, github, org_name, repo_name, milestone):
+        issues = {}
+        for issue in github.iter_issues(org_name,
+                                        repo_name,
+                                        milestone['number'],
+                                        project=self.project):
+            issues[str(issue['number'])] = issue
+        return issues
+
+    def get_issues(self, github, org_name, repo_name, milestone,
+                   updated=None):
+        with self.lock:
+            entry = self.repos.get(repo_name)
+
+        if self.since is None or entry is None or \
+                entry['milestone']['number'] != milestone['number']:
+            # Nothing usable on disk for this repo, fetch the whole milestone
+            issues = self.get_all_issues(github, org_name, repo_name,
+                                         milestone)
+        else:
+            # Only issues touched since the last run can have changed.  They
+            # are fetched without a milestone filter so issues moved out of
+            # the milestone are noticed and dropped.  Callers tracking
+            # several milestones pass the same updated dict for a repo, so
+            # snapshots sharing a since share one listing.
+            if updated is None:
+                updated = {}
+            if self.since not in updated:
+                updated[self.since] = github.get_issues(org_name,
+                                                        repo_name,
+                                                        None,
+                                                        since=self.since,
+                                                        project=project_issue)
+
+            issues = dict(entry['issues'])
+            for issue in updated[self.since]:
+                number = str(issue['number'])
+                if issue['milestone'] is not None and \
+                        issue['milestone']['number'] == milestone['number']:
+                    issues[number] = self.strip(issue)
+                elif number in issues:
+                    del issues[number]
+
+            # Deleted and transferred issues never show up as updated, but
+            # they do drop out of the milestone's counts
+            if len(issues) != milestone['open_issues'] + \
+                    milestone['closed_issues']:
+                issues = self.get_all_issues(github, org_name, repo_name,
+                                             milestone)
+
+        with self.lock:
+            self.seen[repo_name] = {
+                'milestone': project_milestone(milestone),
+                'issues': issues
+            }
+
+        # Match the newest first order of the issues endpoint
+        return sorted(issues.values(),
+                      key=lambda k: k['number'],
+                      reverse=True)
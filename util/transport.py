@@ -0,0 +1,41 @@
+import requests
+
+from abc import ABC, abstractmethod
+from requests.adapters import HTTPAdapter
+
+
+class Transport(ABC):
+    @abstractmethod
+    def request(self, method, url, headers=None, params=None, data=None):
+        pass
+
+    def close(self):
+        return
+
+
+class SessionTransport(Transport):
+    def __init__(self, auth=None, pool_size=10, keep_alive=True):
+        self.session = requests.Session()
+        self.session.auth = auth
+
+        # Keep one connection per worker open between calls so every page
+        # after the first skips the TCP and TLS handshakes
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        if keep_alive:
+            self.session.headers['Connection'] = 'keep-alive'
+        else:
+            self.session.headers['Connection'] = 'close'
+
+    def request(self, method, url, headers=None, params=None, data=None):
+        return self.session.request(method=method,
+                                    headers=headers,
+                                    url=url,
+                                    params=params,
+                                    data=data)
+
+    def close(self):
+        self.session.close()
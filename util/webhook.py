@@ -0,0 +1,230 @@
+import hashlib
+import hmac
+import json
+import sys
+import threading
+import traceback
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from util.builder import Builder
+from util.github import project_issue, project_milestone
+
+
+def verify(secret, body, signature):
+    if signature is None:
+        return False
+    digest = hmac.new(secret.encode('utf-8'), body, hashlib.sha256)
+    return hmac.compare_digest('sha256={}'.format(digest.hexdigest()),
+                               signature)
+
+
+class TrackerState:
+    def __init__(self, milestone_filters, organization, github=None):
+        self.lock = threading.Lock()
+        self.organization = organization
+        self.github = github
+
+        # One live Builder per milestone, kept current change by change
+        self.builds = {}
+        for milestone_filter in milestone_filters:
+            self.builds[milestone_filter] = Builder(milestone_filter,
+                                                    organization)
+
+    def load(self, results):
+        with self.lock:
+            for milestone_filter, repo_name, milestone, issues in results:
+                self.builds[milestone_filter].add_issues(repo_name, issues,
+                                                         milestone)
+
+    def apply(self, event, payload):
+        if event == 'issues':
+            return self.apply_issue(payload['repository']['name'],
+                                    payload['issue'],
+                                    payload['action'],
+                                    payload.get('milestone'))
+        elif event == 'pull_request':
+            pull = dict(payload['pull_request'])
+            pull['pull_request'] = {}
+            return self.apply_issue(payload['repository']['name'],
+                                    pull,
+                                    payload['action'],
+                                    payload.get('milestone'))
+        elif event == 'milestone':
+            return self.apply_milestone(payload['repository']['name'],
+                                        payload['milestone'],
+                                        payload['action'])
+        return False
+
+    def apply_issue(self, repo_name, issue, action, previous=None):
+        issue = project_issue(issue)
+        milestone = issue['milestone']
+
+        # Milestones in the payload carry their counts after the change.
+        # On demilestoned the one the issue left comes alongside it.
+        updates = [milestone]
+        if previous is not None:
+            updates.append(project_milestone(previous))
+
+        target = None
+        if action not in ('deleted', 'transferred') and \
+                milestone is not None and \
+                milestone['state'] == 'open' and \
+                milestone['title'] in self.builds:
+            target = milestone['title']
+
+        changed = False
+        with self.lock:
+            refreshed = []
+            for milestone_filter, build in self.builds.items():
+                current = build.milestones.get(repo_name)
+                for update in updates:
+                    if current is not None and update is not None and \
+                            current['number'] == update['number']:
+                        build.set_milestone(repo_name, update)
+                        refreshed.append(milestone_filter)
+                        changed = True
+
+            # Drop the issue from every milestone it has left
+            for milestone_filter, build in self.builds.items():
+                if milestone_filter == target:
+                    continue
+
+                record = build.records.get((repo_name, issue['number']))
+                if not build.remove_issue(repo_name, issue['number']):
+                    continue
+                changed = True
+
+                # Moving straight to another milestone only names the new
+                # one, so the old one's counts are adjusted by hand
+                if milestone_filter not in refreshed:
+                    self.uncount(build, repo_name, record)
+
+            if target is not None:
+                self.builds[target].upsert_issue(repo_name, issue, milestone)
+                changed = True
+
+        return changed
+
+    def uncount(self, build, repo_name, record):
+        milestone = dict(build.milestones[repo_name])
+        if record.state == 'open':
+            milestone['open_issues'] -= 1
+        else:
+            milestone['closed_issues'] -= 1
+        build.set_milestone(repo_name, milestone)
+
+    def apply_milestone(self, repo_name, milestone, action):
+        milestone = project_milestone(milestone)
+
+        changed = False
+        with self.lock:
+            # A renamed, closed or deleted milestone stops being tracked
+            for milestone_filter, build in self.builds.items():
+                current = build.milestones.get(repo_name)
+                if current is None or \
+                        current['number'] != milestone['number']:
+                    continue
+
+                if action == 'deleted' or \
+                        milestone['state'] != 'open' or \
+                        milestone['title'] != milestone_filter:
+                    build.remove_repo(repo_name)
+                else:
+                    build.set_milestone(repo_name, milestone)
+                changed = True
+
+            # Reopening or renaming a milestone into a tracked title fires
+            # no issue events, so its issues have to be fetched
+            build = self.builds.get(milestone['title'])
+            missing = action in ('opened', 'edited') and \
+                milestone['state'] == 'open' and \
+                build is not None and \
+                build.milestones.get(repo_name) is None
+
+        if missing:
+            if self.github is None:
+                print('Milestone {} in {} is tracked again, restart to load '
+                      'its issues'.format(milestone['title'], repo_name))
+                return changed
+
+            issues = self.github.get_issues(self.organization,
+                                            repo_name,
+                                            milestone['number'],
+                                            project=project_issue)
+            with self.lock:
+                build.add_issues(repo_name, issues, milestone)
+            changed = True
+
+        return changed
+
+
+class Handler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        return
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length)
+
+        if not verify(server.secret, body,
+                      self.headers.get('X-Hub-Signature-256')):
+            return self.reply(401, 'Bad signature')
+
+        event = self.headers.get('X-GitHub-Event')
+        try:
+            payload = json.loads(body.decode('utf-8'))
+        except ValueError:
+            return self.reply(400, 'Bad payload')
+
+        if event == 'ping':
+            return self.reply(200, 'pong')
+
+        # Signed but not shaped like the event it claims to be
+        try:
+            changed = server.state.apply(event, payload)
+        except (KeyError, TypeError):
+            return self.reply(400, 'Bad payload')
+
+        if changed:
+            server.schedule()
+        self.reply(202, 'Accepted')
+
+    def reply(self, status, message):
+        data = message.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class Receiver(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, secret, state, refresh, debounce=5.0):
+        ThreadingHTTPServer.__init__(self, address, Handler)
+        self.secret = secret
+        self.state = state
+        self.refresh = refresh
+        self.debounce = debounce
+        self.timer = None
+        self.lock = threading.Lock()
+
+    def schedule(self):
+        # Every change pushes the publish back, so a burst of events (a
+        # bulk edit, a milestone closing) goes out as one update
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+            self.timer = threading.Timer(self.debounce, self.run)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def run(self):
+        try:
+            self.refresh()
+        except Exception:
+            print('\n')
+            traceback.print_exc(file=sys.stdout)
+            print('\n')